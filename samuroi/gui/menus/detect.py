@@ -101,11 +101,11 @@ class FindEventsMenu(QtGui.QMenu):
 
         segmentation = self.parent().segmentation
 
+        # get the postprocessed traces of all masks in one go
+        masks = segmentation.traceextractor.masks
         # loop over all masks
-        for mask in segmentation.masks:
+        for mask, trace in zip(masks, segmentation.tracecache.traces(masks)):
             # run the algorithm on the trace of the mask
-            trace = segmentation.postprocessor(mask(segmentation.data, segmentation.overlay))
-
             result = algorithm(trace)
 
             # store the result "in" the mask
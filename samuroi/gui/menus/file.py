@@ -1,3 +1,5 @@
+import multiprocessing
+
 from PyQt4 import QtGui
 
 from samuroi.gui.h5dialogs import H5LoadDialog, H5SaveDialog
@@ -61,7 +63,8 @@ class FileMenu(QtGui.QMenu):
                                                      ".",
                                                      "TIF Files (*.tif *.tiff)")
         from samuroi.plugins.tif import load_tif
-        data = load_tif(str(fileName))
+        data = load_tif(str(fileName), frame_major=self.app.segmentation.frame_major,
+                        workers=multiprocessing.cpu_count())
         self.app.segmentation.data = data
 
     def save_hdf5(self):
@@ -41,13 +41,23 @@ class TreeItem(object):
         self.model.dataChanged.emit(QtCore.QModelIndex(), QtCore.QModelIndex())
         return i
 
+    def forget(self):
+        """Drop this item and all its descendants from the mask to item map of the model."""
+        for child in self.children:
+            child.forget()
+        if self.mask is not None and self.model.mask2roitreeitem.get(self.mask) is self:
+            del self.model.mask2roitreeitem[self.mask]
+
     def remove(self, child=None, slice=None):
         if child is not None:
+            child.forget()
             childi = self.row(child)
             self.model.beginRemoveRows(self.index, childi, childi)
             self.__children.remove(child)
             self.model.endRemoveRows()
         elif slice is not None:
+            for item in self.__children[slice]:
+                item.forget()
             indices = slice.indices(len(self))
             self.model.beginRemoveRows(self.index, indices[0], indices[0] + indices[1] - indices[0] - 1)
             del self.__children[slice]
@@ -97,12 +107,8 @@ class RootItem(TreeItem):
 
     def find(self, mask):
         """Return the tree node that holds given mask."""
-        # because the mask could be a child mask of any type we need to search all groups
-        for child in self.children:
-            node = child.find(mask)
-            if node is not None:
-                return node
-        return None
+        # the model keeps track of the items of all masks, including child masks
+        return self.model.mask2roitreeitem.get(mask)
 
     @TreeItem.mask.getter
     def mask(self):
@@ -173,6 +179,7 @@ class RoiItem(TreeItem):
     @mask.setter
     def mask(self, m):
         self.__mask = m
+        self.model.mask2roitreeitem[m] = self
         if hasattr(self.mask, "children"):
             TreeItem.add(self, [RoiItem(parent=self, model=self.model) for child in self.mask.children])
             for item, mask in zip(self.children, self.mask.children):
@@ -227,8 +234,7 @@ class RoiTreeModel(QtCore.QAbstractItemModel):
         self.mask_added.connect(self.root.add)
         self.mask_removed.connect(self.root.remove)
 
-        # self.mask2roitreeitem = {}
-
+        self.mask2roitreeitem = {}
         """ Keep track of all items in the hierarchy and provide easy mapping from mask to the treeitems of the rois"""
 
     def flags(self, index):
@@ -243,7 +249,7 @@ class RoiTreeModel(QtCore.QAbstractItemModel):
 
     def find(self, mask):
         """ find the tree index of the given mask"""
-        return self.root.find(mask).index
+        return self.mask2roitreeitem[mask].index
 
     def setData(self, index, value, role=QtCore.Qt.DisplayRole):
         """Sets the role data for the item at index to value."""
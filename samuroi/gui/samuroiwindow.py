@@ -25,7 +25,7 @@ class SamuROIWindow(QtGui.QMainWindow):
         with self.frame_widget.canvas.draw_on_exit(), self.tracedockwidget.canvas.draw_on_exit(), self.linescandockwidget.canvas.draw_on_exit():
             yield
 
-    def __init__(self, data, morphology=None):
+    def __init__(self, data, morphology=None, frame_major=False):
         """
         Create and show the gui for data analysis.
         Args:
@@ -34,10 +34,11 @@ class SamuROIWindow(QtGui.QMainWindow):
             mean: Background image. Defaults to data.mean(axis = -1)
             pmin,pmax: Percentiles for color range. I.e. the color range for mean and data will start at pmin %
                            and reach up to pmax %. Defaults to (10,99)
+            frame_major: Store the data frame contiguous, see :py:attr:`samuroi.SamuROIData.frame_major`.
         """
         QtGui.QMainWindow.__init__(self)
 
-        self.segmentation = SamuROIData(data, morphology)
+        self.segmentation = SamuROIData(data, morphology, frame_major=frame_major)
 
         # set window title
         self.setWindowTitle("SamuROI")
@@ -59,17 +59,19 @@ class MaskToolbar(ToolBar):
 class SplitJoinToolbar(ToolBar):
     def split_selected(self):
         from ..masks.branch import BranchMask
+        masks = []
+        for sr in self.parent().roiselectionmodel.selection():
+            for index in sr.indexes():
+                item = index.internalPointer()
+                if type(item.mask) is BranchMask and item.mask not in masks:
+                    masks.append(item.mask)
         with self.parent().draw_on_exit():
-            for sr in self.parent().roiselectionmodel.selection():
-                for index in sr.indexes():
-                    item = index.internalPointer()
-                    if type(item.mask) is BranchMask:
-                        item.mask.split(length=self.split_length_widget.value())
+            BranchMask.split_many(masks, length=self.split_length_widget.value())
 
     def split_all(self):
+        from ..masks.branch import BranchMask
         with self.parent().draw_on_exit():
-            for mask in self.active_segmentation.branchmasks:
-                mask.split(length=self.split_length_widget.value())
+            BranchMask.split_many(self.active_segmentation.branchmasks, length=self.split_length_widget.value())
 
     def __init__(self, parent, *args, **kwargs):
         super(SplitJoinToolbar, self).__init__(parent=parent, *args, **kwargs)
@@ -250,6 +252,8 @@ class PostProcessorToolbar(ToolBar):
     def update_posprocessor(self):
         p = PostProcessorPipe()
 
+        if self.toggle_baseline.isChecked():
+            p.append(RollingPercentilePostProcessor(N=self.spin_baseline.value()))
         if self.toggle_detrend.isChecked():
             p.append(DetrendPostProcessor())
         if self.toggle_smoothen.isChecked():
@@ -259,9 +263,27 @@ class PostProcessorToolbar(ToolBar):
     def spin_smoothen_changed(self, value):
         self.update_posprocessor()
 
+    def spin_baseline_changed(self, value):
+        self.update_posprocessor()
+
     def __init__(self, parent, *args, **kwargs):
         super(PostProcessorToolbar, self).__init__(parent, *args, **kwargs)
 
+        self.toggle_baseline = self.addAction("dF/F0")
+        tooltip = "Calculate deltaF/F0 of all traces bevore plotting, where F0 is the running 10th percentile of N \n" + \
+                  "frames. Select N with spin box to the right."
+        self.toggle_baseline.setToolTip(tooltip)
+        self.toggle_baseline.setCheckable(True)
+        self.toggle_baseline.triggered.connect(self.update_posprocessor)
+
+        self.spin_baseline = QtGui.QSpinBox()
+        self.spin_baseline.setMinimum(1)
+        self.spin_baseline.setMaximum(100000)
+        self.spin_baseline.setValue(100)
+        self.spin_baseline.setToolTip("Choose the number of frames for the running percentile.")
+        self.spin_baseline.valueChanged.connect(self.spin_baseline_changed)
+        self.addWidget(self.spin_baseline)
+
         self.toggle_detrend = self.addAction("Detrend")
         self.toggle_detrend.setToolTip("Apply linear detrend on all traces bevore plotting.")
         self.toggle_detrend.setCheckable(True)
@@ -280,5 +302,5 @@ class PostProcessorToolbar(ToolBar):
         self.spin_smoothen.setMinimum(2)
         self.spin_smoothen.setToolTip("Choose the number of frames for the moving average.")
         self.spin_smoothen.valueChanged.connect(self.spin_smoothen_changed)
-        self.setToolTip("If both postprocessors are active, detrend will be applied first.")
+        self.setToolTip("The active postprocessors are applied in the order dF/F0, detrend, smoothen.")
         self.addWidget(self.spin_smoothen)
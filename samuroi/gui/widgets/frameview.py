@@ -29,9 +29,14 @@ class FrameViewCanvas(CanvasBase):
 
         # a map, mapping from mask to artist
         self.__artists = {}
+        # a map, mapping from mask to the children it had when their artists were created
+        self.__child_masks = {}
         from itertools import cycle
         self.colorcycle = cycle('bgrcm')
 
+        self.active_mask_creators = set()
+        """The mask creators which currently handle the clicks into the axes, masks are not picked meanwhile."""
+
         pmin, pmax = 10, 99
         vmin, vmax = numpy.percentile(self.segmentation.morphology.flatten(), q=[pmin, pmax])
         self.meanimg = self.axes.imshow(self.segmentation.morphology, cmap=matplotlib.cm.gray,
@@ -64,7 +69,7 @@ class FrameViewCanvas(CanvasBase):
         # connect to selection model
         self.selectionmodel.selectionChanged.connect(self.on_selection_changed)
 
-        self.mpl_connect('pick_event', self.onpick)
+        self.mpl_connect('button_press_event', self.onpick)
 
     @property
     def rgba_overlay(self):
@@ -105,7 +110,7 @@ class FrameViewCanvas(CanvasBase):
         self.draw()
 
     def create_outlined_artist(self, mask, color, **kwargs):
-        artist = matplotlib.patches.Polygon(xy=mask.outline - 0.5, lw=1, picker=True, fill=False, color='gray',
+        artist = matplotlib.patches.Polygon(xy=mask.outline - 0.5, lw=1, fill=False, color='gray',
                                             **kwargs)
 
         artist.color = color
@@ -130,6 +135,8 @@ class FrameViewCanvas(CanvasBase):
     def create_outlined_child_artits(self, parent):
         """Create outlined artists for all children of given mask"""
         with self.draw_on_exit():
+            # memorize the children, such that their artists can be removed once the children changed
+            self.__child_masks[parent] = list(getattr(parent, "children", []))
             for child in getattr(parent, "children", []):
                 if not hasattr(child, "color"):
                     child.color = self.colorcycle.next()
@@ -140,18 +147,12 @@ class FrameViewCanvas(CanvasBase):
         # note: because the children are already removed when this function is called,
         #       we need to get the children to be removed from our own container...
         with self.draw_on_exit():
-            # gather all former children of the changed mask in a list
-            old_children = []
-            for mask, artist in self.__artists.iteritems():
-                # check if the mask has parent and the parent is the mask which was modified
-                if hasattr(mask, "parent") and mask.parent is parent:
-                    old_children.append(mask)
             # remove all former children
-            for mask in old_children:
+            for mask in self.__child_masks.pop(parent, []):
                 self.remove_mask(mask)
 
     def create_circle_artist(self, mask, color, **kwargs):
-        artist = matplotlib.patches.Circle(radius=mask.radius, xy=mask.center - 0.5, lw=1, picker=True, fill=False,
+        artist = matplotlib.patches.Circle(radius=mask.radius, xy=mask.center - 0.5, lw=1, fill=False,
                                            color='gray', **kwargs)
 
         artist.color = color
@@ -264,6 +265,7 @@ class FrameViewCanvas(CanvasBase):
                 artist = self.__artists[mask]
                 artist.remove()
                 del self.__artists[mask]
+            self.__child_masks.pop(mask, None)
             if hasattr(mask, "changed"):
                 mask.changed.remove(self.on_mask_changed)
 
@@ -304,9 +306,19 @@ class FrameViewCanvas(CanvasBase):
         self.draw()
 
     def onpick(self, event):
+        if event.inaxes is not self.axes or event.xdata is None or event.button != 1:
+            return
+        # clicks for panning, zooming or creating masks do not change the selection
+        toolbar = getattr(self, "toolbar", None)
+        if (toolbar is not None and toolbar.mode != '') or len(self.active_mask_creators) > 0:
+            return
+        # the artists are shifted by half a pixel with respect to the mask coordinates. Look up the masks at the
+        # position in the spatial index of the maskset, the smallest mask (e.g. a segment instead of its branch) wins.
+        masks = self.segmentation.masks.at(event.xdata + 0.5, event.ydata + 0.5)
+        if len(masks) == 0:
+            return
         with self.draw_on_exit():
-            # get the mask from the event
-            mask = event.artist.mask
+            mask = masks[0]
             # get the model underlying the selection
             model = self.selectionmodel.model()
 
@@ -314,7 +326,7 @@ class FrameViewCanvas(CanvasBase):
             index = model.find(mask)
 
             # if shift key is not pressed clear selection
-            if not (event.guiEvent.modifiers() and QtCore.Qt.ShiftModifier):
+            if not (event.guiEvent.modifiers() & QtCore.Qt.ShiftModifier):
                 self.selectionmodel.clear()
             self.selectionmodel.select(index, QtGui.QItemSelectionModel.Select)
 
@@ -32,9 +32,6 @@ class RasterViewCanvas(CanvasBase):
         self.segmentation.data_changed.append(self.on_data_change)
         self.segmentation.postprocessor_changed.append(self.on_data_change)
 
-        # cache calculated line scans in dictionary having the branch mask as key
-        self.__linescans = {}
-
     def on_active_frame_change(self):
         if hasattr(self, "active_frame_line"):
             self.active_frame_line.remove()
@@ -42,13 +39,11 @@ class RasterViewCanvas(CanvasBase):
         self.draw()
 
     def on_overlay_change(self):
-        self.__linescans.clear()
         # force update
         if self.parent_mask is not None:
             self.redraw()
 
     def on_data_change(self):
-        self.__linescans.clear()
         # force update
         if self.parent_mask is not None:
             self.redraw()
@@ -101,24 +96,14 @@ class RasterViewCanvas(CanvasBase):
 
     def on_mask_change(self, branch):
         """Will be called when the parent masks number of children changes."""
-        if branch in self.__linescans:
-            del self.__linescans[branch]
         self.redraw()
 
     @property
     def linescan(self):
         """
-        Calculate the trace for all children and return a 2D array aka linescan for that branch roi.
+        Get the trace for all children and return a 2D array aka linescan for that branch roi.
         """
-        if self.parent_mask in self.__linescans:
-            return self.__linescans[self.parent_mask]
-        import numpy
-        data = self.segmentation.data
-        overlay = self.segmentation.overlay
-        postprocessor = self.segmentation.postprocessor
-        self.__linescans[self.parent_mask] = numpy.row_stack(
-            (postprocessor(child(data, overlay)) for child in self.parent_mask.children))
-        return self.__linescans[self.parent_mask]
+        return self.segmentation.tracecache.traces(self.parent_mask.children)
 
     def onclick(self, event):
         if self.parent_mask is not None and event.ydata is not None:
@@ -44,9 +44,12 @@ class TraceViewCanvas(CanvasBase):
     def update_traces(self):
         tmax = self.segmentation.data.shape[-1]
         x = numpy.linspace(0, tmax, tmax, False, dtype=int)
-        for mask, line in self.__traces.iteritems():
-            tracedata = self.segmentation.postprocessor(mask(self.segmentation.data, self.segmentation.overlay))
-            line.set_data(x, tracedata)
+        masks = list(self.__traces.keys())
+        if len(masks) > 0:
+            # get all traces in one go
+            traces = self.segmentation.tracecache.traces(masks)
+            for mask, tracedata in zip(masks, traces):
+                self.__traces[mask].set_data(x, tracedata)
         self.axes.relim()
         self.axes.autoscale_view(scalex=False)
         self.draw()
@@ -81,8 +84,7 @@ class TraceViewCanvas(CanvasBase):
                     artists = []
                     if not hasattr(item.mask, "color"):
                         item.mask.color = cycol()
-                    tracedata = self.segmentation.postprocessor(
-                        item.mask(self.segmentation.data, self.segmentation.overlay))
+                    tracedata = self.segmentation.tracecache.trace(item.mask)
                     line, = self.axes.plot(tracedata, color=item.mask.color)
                     self.__traces[item.mask] = line
                     # put a handle of the mask on the artist
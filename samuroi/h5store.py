@@ -0,0 +1,353 @@
+import os
+import uuid
+from collections import OrderedDict
+from functools import partial
+
+import numpy
+
+
+def mask_kinds():
+    """
+    The kinds of masks which can be stored in hdf5 files.
+
+    :return: list of tuples (group name, mask type).
+    """
+    from .masks.pixel import PixelMask
+    from .masks.polygon import PolygonMask
+    from .masks.circle import CircleMask
+    from .masks.branch import BranchMask
+    from .masks.segmentation import Segmentation
+    return [('pixels', PixelMask), ('polygons', PolygonMask), ('circles', CircleMask), ('branches', BranchMask),
+            ('segmentations', Segmentation)]
+
+
+class H5Store(object):
+    """
+    Save a :py:class:`samuroi.SamuROIData` object into a versioned hdf5 layout and keep track of all changes since the
+    last save. Repeated saves into the same file only rewrite the parts which changed in the meantime.
+
+    The structure of the hdf5 file (version 2) is as follows:
+
+    - attributes `version` and `token`, the latter identifies the store that wrote the file.
+    - overlay (dataset, optional, binary mask defined by threshold value, threshold is stored as attribute)
+    - data (dataset, optional, the full 3D dataset with shape (Y,X,T), chunked along time and optionally compressed)
+    - masks/pixels, masks/polygons, masks/circles, masks/branches, masks/segmentations (groups, optional, each holding
+      the consolidated table of all masks of the respective type, see e.g.
+      :py:func:`samuroi.masks.polygon.PolygonMask.to_table`)
+    - traces/data (dataset, optional, 2D array with the postprocessed trace of one mask (or child mask) per row)
+    - traces/names (dataset, optional, the name of the mask of each row of traces/data, empty for unused rows)
+
+    Only the tables of those mask types which had masks added, removed or changed get rewritten. Likewise only the
+    traces of new or changed masks get calculated and written into the rows of the traces dataset. Changes of the
+    data, overlay or postprocessor invalidate all traces.
+
+    .. code-block:: python
+
+        samudata.save_hdf5("project.h5", data=True, compression="gzip")
+        # move some polygon ...
+        # only rewrites the polygon table and the trace of the polygon
+        samudata.save_hdf5("project.h5", data=True, compression="gzip")
+    """
+
+    version = 2
+    """The version of the file layout."""
+
+    def __init__(self, segmentation):
+        """
+        :param segmentation: the :py:class:`samuroi.SamuROIData` object to store.
+        """
+        self.segmentation = segmentation
+
+        # the absolute path and the token of the file which was written last
+        self.__filename = None
+        self.__token = None
+
+        # the groups of the mask tables that need to be rewritten
+        self.__tables = set()
+        # the masks whose traces need to be recalculated
+        self.__stale = set()
+        self.__alltraces = True
+        self.__data = True
+        # the row in the traces dataset of each mask
+        self.__rows = {}
+
+        # the handlers connected to the changed events of the masks
+        self.__handlers = {}
+
+        self.segmentation.masks.added.append(self.on_mask_added)
+        self.segmentation.masks.removed.append(self.on_mask_removed)
+        self.segmentation.overlay_changed.append(self.on_traces_changed)
+        self.segmentation.postprocessor_changed.append(self.on_traces_changed)
+        self.segmentation.data_changed.append(self.on_data_changed)
+
+        for kind, type in mask_kinds():
+            if type in self.segmentation.masks.types():
+                for mask in self.segmentation.masks[type]:
+                    self.__connect(mask)
+
+    def __kind(self, mask):
+        """The name of the table group of the mask."""
+        for kind, type in mask_kinds():
+            if isinstance(mask, type):
+                return kind
+
+    def __connect(self, mask):
+        if hasattr(mask, "changed"):
+            self.__handlers[mask] = partial(self.on_mask_changed, mask)
+            mask.changed.append(self.__handlers[mask])
+
+    def on_mask_added(self, mask):
+        self.__connect(mask)
+        self.__tables.add(self.__kind(mask))
+
+    def on_mask_removed(self, mask):
+        if mask in self.__handlers:
+            mask.changed.remove(self.__handlers.pop(mask))
+        self.__tables.add(self.__kind(mask))
+
+    def on_mask_changed(self, mask, *args):
+        # the changed events of the masks get triggered with or without the mask as argument
+        self.__tables.add(self.__kind(mask))
+        self.__stale.add(mask)
+        self.__stale.update(getattr(mask, "children", []))
+
+    def on_traces_changed(self):
+        self.__alltraces = True
+
+    def on_data_changed(self):
+        self.__data = True
+        self.__alltraces = True
+
+    def save(self, filename, overlay=True, data=False, traces=True, kinds=None, compression=None,
+             compression_opts=None, timechunks=None, incremental=True):
+        """
+        Save the segmentation into the given file.
+
+        :param filename: the filename to write to.
+        :param overlay: flag whether the overlay should be stored.
+        :param data: flag whether the data should be stored.
+        :param traces: flag whether the traces should be stored.
+        :param kinds: the names of the mask tables to store (see :py:func:`samuroi.h5store.mask_kinds`), defaults to
+                      all.
+        :param compression: the hdf5 compression filter for the data and large mask tables, e.g. "gzip" or "lzf".
+        :param compression_opts: the options of the compression filter.
+        :param timechunks: the number of frames per chunk of the stored data. Defaults to chunks of about 1 MiB.
+        :param incremental: if True and the file was written by this store before, only rewrite what changed.
+                            Otherwise the whole file is rewritten.
+        """
+        import h5py
+
+        filename = os.path.abspath(filename)
+        if kinds is None:
+            kinds = [kind for kind, type in mask_kinds()]
+
+        f = None
+        if incremental and filename == self.__filename and os.path.exists(filename):
+            f = h5py.File(filename, mode='a')
+            if f.attrs.get('version') != self.version or f.attrs.get('token') != self.__token:
+                # someone else modified the file
+                f.close()
+                f = None
+
+        if f is None:
+            f = h5py.File(filename, mode='w')
+            self.__token = uuid.uuid4().hex
+            self.__tables = set(kind for kind, type in mask_kinds())
+            self.__alltraces = True
+            self.__data = True
+            self.__rows = {}
+
+        try:
+            f.attrs['version'] = self.version
+            f.attrs['token'] = self.__token
+
+            if 'overlay' in f:
+                del f['overlay']
+            if overlay:
+                f.create_dataset('overlay', data=self.segmentation.overlay)
+                f['overlay'].attrs['threshold'] = self.segmentation.threshold
+
+            if not data:
+                if 'data' in f:
+                    del f['data']
+            elif self.__data or 'data' not in f:
+                if 'data' in f:
+                    del f['data']
+                self.__write_data(f, compression, compression_opts, timechunks)
+
+            for kind, type in mask_kinds():
+                group = 'masks/' + kind
+                if group in f and (kind not in kinds or kind in self.__tables):
+                    del f[group]
+                if kind in kinds and group not in f:
+                    masks = list(self.segmentation.masks[type]) if type in self.segmentation.masks.types() else []
+                    self.__write_table(f.require_group(group), type.to_table(masks), compression, compression_opts)
+
+            if not traces:
+                if 'traces' in f:
+                    del f['traces']
+            else:
+                self.__write_traces(f)
+        finally:
+            f.close()
+
+        # everything that was not written was removed from the file
+        self.__filename = filename
+        self.__tables.clear()
+        self.__stale.clear()
+        self.__alltraces = False
+        self.__data = False
+
+    def __write_data(self, f, compression, compression_opts, timechunks):
+        """Write the data in blocks of chunks, such that lazy data sources need not be loaded at once."""
+        data = self.segmentation.data
+        Y, X, T = data.shape
+        if timechunks is None:
+            timechunks = 2 ** 20 // (Y * X * numpy.dtype(data.dtype).itemsize)
+        timechunks = int(max(1, min(timechunks, T)))
+        dataset = f.create_dataset('data', shape=data.shape, dtype=data.dtype, chunks=(Y, X, timechunks),
+                                   compression=compression, compression_opts=compression_opts)
+        for start in range(0, T, timechunks):
+            stop = min(start + timechunks, T)
+            dataset[..., start:stop] = data[..., start:stop]
+
+    @staticmethod
+    def __write_table(group, table, compression, compression_opts):
+        for key, array in table.items():
+            if array.size > 0 and array.ndim == 3:
+                # e.g. the label images of segmentations, one chunk per image
+                group.create_dataset(key, data=array, chunks=(1,) + array.shape[1:], compression=compression,
+                                     compression_opts=compression_opts)
+            else:
+                group.create_dataset(key, data=array)
+
+    def __write_traces(self, f):
+        extractor = self.segmentation.traceextractor
+        masks = extractor.masks
+        T = self.segmentation.data.shape[-1]
+
+        if self.__alltraces or 'traces' not in f or f['traces/data'].shape[1] != T:
+            if 'traces' in f:
+                del f['traces']
+            self.__rows = {}
+
+        # keep the rows of all unchanged masks, reuse the rows of removed masks
+        present = set(masks)
+        rows = dict((m, r) for m, r in self.__rows.items() if m in present and m not in self.__stale)
+        new = [m for m in masks if m not in rows]
+        nrows = f['traces/data'].shape[0] if 'traces' in f else 0
+        free = sorted(set(range(nrows)).difference(rows.values()))
+        free += range(nrows, nrows + len(new) - len(free))
+        rows.update(zip(new, free))
+        nrows = max([nrows] + [r + 1 for r in free[:len(new)]])
+
+        values = self.segmentation.tracecache.traces(new)
+
+        if 'traces' not in f:
+            f.create_dataset('traces/data', data=values, maxshape=(None, T), chunks=True)
+        else:
+            dataset = f['traces/data']
+            dataset.resize(nrows, axis=0)
+            for m, v in zip(new, values):
+                dataset[rows[m]] = v
+
+        names = numpy.zeros(shape=nrows, dtype=object)
+        names[:] = ''
+        for m, r in rows.items():
+            names[r] = m.name
+        if 'traces/names' in f:
+            del f['traces/names']
+        f.create_dataset('traces/names', data=names.astype('S'))
+        self.__rows = rows
+
+
+class H5DataView(object):
+    """
+    A read only, windowed view on a 3D hdf5 dataset with shape (Y,X,T), which can be used as
+    :py:attr:`samuroi.SamuROIData.data` while the file stays open. Indexing reads whole chunks of frames along the time
+    axis and keeps the most recently used chunks in a LRU cache, such that e.g. stepping through the frames of the video
+    only touches the disk once per chunk. The result of indexing is the same as for the full numpy array.
+    """
+
+    def __init__(self, dataset, cachesize=256 * 2 ** 20):
+        """
+        :param dataset: the h5py dataset.
+        :param cachesize: the maximal size of the cached chunks in bytes.
+        """
+        self.dataset = dataset
+        Y, X, T = dataset.shape
+        framesize = Y * X * dataset.dtype.itemsize
+        if dataset.chunks is not None:
+            self.timechunks = dataset.chunks[2]
+        else:
+            # contiguous datasets are read in blocks of about 1 MiB
+            self.timechunks = max(1, 2 ** 20 // framesize)
+        self.maxchunks = max(1, cachesize // (framesize * self.timechunks))
+        self.__cache = OrderedDict()
+
+    @property
+    def shape(self):
+        return self.dataset.shape
+
+    @property
+    def dtype(self):
+        return self.dataset.dtype
+
+    @property
+    def ndim(self):
+        return 3
+
+    def __len__(self):
+        return self.shape[0]
+
+    def chunk(self, i):
+        """
+        Get the i-th chunk of frames.
+
+        :param i: the index of the chunk along the time axis.
+        :return: numpy array with shape (Y,X,timechunks), the last chunk may be shorter.
+        """
+        if i in self.__cache:
+            # mark the chunk as most recently used
+            block = self.__cache.pop(i)
+        else:
+            block = self.dataset[..., i * self.timechunks:(i + 1) * self.timechunks]
+            if len(self.__cache) >= self.maxchunks:
+                self.__cache.popitem(last=False)
+        self.__cache[i] = block
+        return block
+
+    def __getitem__(self, key):
+        # normalize the key to a tuple of three indices
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = next(i for i, k in enumerate(key) if k is Ellipsis)
+            key = key[:i] + (slice(None),) * (4 - len(key)) + key[i + 1:]
+        key = key + (slice(None),) * (3 - len(key))
+
+        times = numpy.arange(self.shape[2])[key[2]]
+        if numpy.size(times) == 0:
+            return self.dataset[key]
+
+        # load the range of chunks covering the requested frames
+        first = numpy.min(times) // self.timechunks
+        last = numpy.max(times) // self.timechunks
+        offset = first * self.timechunks
+        if first == last:
+            block = self.chunk(first)
+        else:
+            block = numpy.concatenate([self.chunk(i) for i in range(first, last + 1)], axis=2)
+
+        # translate the time index into the block, but keep slices as slices to preserve the numpy indexing semantics
+        if isinstance(key[2], slice):
+            step = key[2].indices(self.shape[2])[2]
+            stop = times[-1] - offset + (1 if step > 0 else -1)
+            timekey = slice(times[0] - offset, stop if stop >= 0 else None, step)
+        else:
+            timekey = times - offset
+        return block[key[0], key[1], timekey]
+
+    def __array__(self, dtype=None):
+        data = self[...]
+        return data if dtype is None else data.astype(dtype)
@@ -3,7 +3,8 @@ import numpy.linalg
 
 from .mask import Mask
 from ..util.event import Event
-from ..util.branch import Branch
+from ..util.branch import Branch, split_branches
+from ..util.rasterize import polygon_pixels
 
 from .segment import SegmentMask
 
@@ -14,16 +15,24 @@ class BranchMask(Mask):
     Provide functionality for splitting, joining and iterating over segments.
     """
 
-    def __init__(self, data=None, name=None):
-        """Can be constructed as Branch(kind,x,y,z,r) or Branch(swc[start:end])."""
+    def __init__(self, data=None, name=None, pixels=None):
+        """
+        Can be constructed as Branch(kind,x,y,z,r) or Branch(swc[start:end]).
+
+        :param data: the record array of the branch, or a :py:class:`samuroi.util.branch.Branch` object to wrap.
+        :param name: the name of the mask.
+        :param pixels: optional precalculated pixel coverage of the outline (see
+                       :py:func:`samuroi.util.rasterize.polygon_pixels`).
+        """
         super(BranchMask, self).__init__(name=name)
-        self.branch = Branch(data=data)
+        # wrap branch objects directly, such that their memoized outline is reused
+        self.branch = data if isinstance(data, Branch) else Branch(data=data)
 
         self.segments = []
         """Child masks aka segments of the branch."""
 
         from .polygon import PolygonMask
-        self.__polygon = PolygonMask(outline=self.outline)
+        self.__polygon = PolygonMask(outline=self.outline, pixels=pixels)
 
         self.changed = Event()
         """The event which will be triggered when the branch mask was changed."""
@@ -57,6 +66,15 @@ class BranchMask(Mask):
     def __call__(self, data, mask):
         return self.__polygon(data, mask)
 
+    def sparse_weights(self, shape):
+        return self.__polygon.sparse_weights(shape)
+
+    def bounding_box(self):
+        return self.__polygon.bounding_box()
+
+    def contains(self, x, y):
+        return self.__polygon.contains(x, y)
+
     def to_hdf5(self, f):
         if 'branches' not in f:
             f.create_group('branches')
@@ -85,6 +103,57 @@ class BranchMask(Mask):
                         branch.children.append(child)
                 yield branch
 
+    @staticmethod
+    def to_table(masks):
+        """
+        Consolidate the given branch masks and their segments into one table (see :py:class:`samuroi.h5store.H5Store`).
+        The outlines are not stored, since they are defined by the data of the branches.
+
+        :param masks: list of branch masks.
+        :return: dictionary with the arrays `names`, `indptr` and `data` for the branches, where the data of branch i is
+                 `data[indptr[i]:indptr[i+1]]`. The segments are stored alike in the arrays `segment_names`,
+                 `segment_indptr` and `segment_data`, with the additional array `segment_parent` holding the index of
+                 the branch of each segment.
+        """
+        segments = [s for m in masks for s in m.children]
+        dtype = [('x', float), ('y', float), ('z', float), ('radius', float)]
+
+        def records(branches):
+            return numpy.concatenate([numpy.rec.fromarrays([b.data['x'], b.data['y'], b.data['z'], b.data['radius']],
+                                                           dtype=dtype) for b in branches] +
+                                     [numpy.empty(shape=0, dtype=dtype)])
+
+        return dict(names=numpy.array([m.name for m in masks], dtype='S'),
+                    indptr=numpy.cumsum([0] + [len(m.data) for m in masks]),
+                    data=records(masks),
+                    segment_names=numpy.array([s.name for s in segments], dtype='S'),
+                    segment_indptr=numpy.cumsum([0] + [len(s.data) for s in segments]),
+                    segment_data=records(segments),
+                    segment_parent=numpy.repeat(numpy.arange(len(masks)), [len(m.children) for m in masks]))
+
+    @staticmethod
+    def from_table(table):
+        """
+        Create branch masks from a table as written by :py:func:`samuroi.masks.branch.BranchMask.to_table`.
+
+        :param table: dictionary like object (e.g. a hdf5 group) holding the arrays of the table.
+        :return: generator over the masks.
+        """
+        names, indptr, data = table['names'][...], table['indptr'][...], table['data'][...]
+        segment_names, segment_indptr = table['segment_names'][...], table['segment_indptr'][...]
+        segment_data, segment_parent = table['segment_data'][...], table['segment_parent'][...]
+        # the segments of each branch are stored consecutively
+        bounds = numpy.searchsorted(segment_parent, numpy.arange(len(names) + 1))
+
+        for i, name in enumerate(names):
+            branch = BranchMask(name=name.decode(), data=data[indptr[i]:indptr[i + 1]])
+            for j in range(bounds[i], bounds[i + 1]):
+                child = SegmentMask(parent=branch,
+                                    data=segment_data[segment_indptr[j]:segment_indptr[j + 1]])
+                child.name = segment_names[j].decode()
+                branch.children.append(child)
+            yield branch
+
     def move(self, offset):
         """Move the branch and all its children."""
 
@@ -117,9 +186,30 @@ class BranchMask(Mask):
         :param k: smoothness parameter for spline interpolation
         :param s: smoothness parameter for spline interpolation
         """
-        branches = self.branch.split(nsegments=nsegments, length=length, k=k, s=s)
-        self.segments = [SegmentMask(data=b.data, parent=self) for b in branches]
-        self.changed(self)
+        BranchMask.split_many([self], nsegments=nsegments, length=length, k=k, s=s)
+
+    @staticmethod
+    def split_many(masks, nsegments=2, length=None, k=1, s=0):
+        """
+        Split many branches at once, e.g. all branches of a dendritic tree. The segments of all branches are created in
+        one batch (see :py:func:`samuroi.util.branch.split_branches`) and their outlines are rasterized in one batch.
+        Triggers the :py:attr:`samuroi.masks.branch.BranchMask.changed` event of each branch.
+
+        :param masks: iterable of :py:class:`samuroi.masks.branch.BranchMask` objects.
+        :param nsegments: the number of segments per branch.
+        :param length: the length of each segment (the last segment will have the remainder of modulo division).
+        :param k: smoothness parameter for spline interpolation
+        :param s: smoothness parameter for spline interpolation
+        """
+        masks = list(masks)
+        segments = split_branches([mask.branch for mask in masks], nsegments=nsegments, length=length, k=k, s=s)
+        # calculate and rasterize the outlines of all segments in one batch
+        Branch.memoize_corners([b for branches in segments for b in branches])
+        pixels = iter(polygon_pixels([b.outline for branches in segments for b in branches]))
+        for mask, branches in zip(masks, segments):
+            mask.segments = [SegmentMask(data=b, parent=mask, pixels=next(pixels)) for b in branches]
+        for mask in masks:
+            mask.changed(mask)
 
     def linescan(self, data, mask):
         """
@@ -58,5 +58,38 @@ class CircleMask(Mask):
                 radius = dataset.value[2]
                 yield CircleMask(name=name, center=center, radius=radius)
 
+    @staticmethod
+    def to_table(masks):
+        """
+        Consolidate the given circle masks into one table (see :py:class:`samuroi.h5store.H5Store`).
+
+        :param masks: list of circle masks.
+        :return: dictionary with the arrays `names` and `circles`, the latter with one row (x, y, radius) per mask.
+        """
+        import numpy
+        return dict(names=numpy.array([m.name for m in masks], dtype='S'),
+                    circles=numpy.array([[m.center[0], m.center[1], m.radius] for m in masks], dtype=float).reshape(-1, 3))
+
+    @staticmethod
+    def from_table(table):
+        """
+        Create circle masks from a table as written by :py:func:`samuroi.masks.circle.CircleMask.to_table`.
+
+        :param table: dictionary like object (e.g. a hdf5 group) holding the arrays of the table.
+        :return: generator over the masks.
+        """
+        names, circles = table['names'][...], table['circles'][...]
+        for name, (x, y, radius) in zip(names, circles):
+            yield CircleMask(name=name.decode(), center=(x, y), radius=radius)
+
     def __call__(self, data, mask):
         return self.__polygon(data, mask)
+
+    def sparse_weights(self, shape):
+        return self.__polygon.sparse_weights(shape)
+
+    def bounding_box(self):
+        return self.__polygon.bounding_box()
+
+    def contains(self, x, y):
+        return self.__polygon.contains(x, y)
@@ -4,6 +4,12 @@ from abc import abstractmethod
 class Mask(object):
     """If a mask is mutable, it needs to provide a changed signal, which is supposed to be triggered upon modification."""
 
+    overlay_normalized = True
+    """
+    Whether the trace is normalized by the weights that remain after applying the overlay (True), or by the total
+    weight of the mask (False).
+    """
+
     # count created objects, useful for creating suffixes
     __count = {}
 
@@ -26,6 +32,38 @@ class Mask(object):
         """
         raise NotImplementedError()
 
+    @abstractmethod
+    def sparse_weights(self, shape):
+        """
+        Get the pixel weights of this mask in sparse form, such that the trace of the mask can be calculated as
+        weighted sum over the flattened video pixels (see :py:class:`samuroi.traceextractor.TraceExtractor`).
+
+        :param shape: the image shape (Y,X) of the video data.
+        :return: tuple (indices, weights) of 1D arrays, where indices are flat pixel indices into an image of given shape.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def bounding_box(self):
+        """
+        Get the bounding box of the mask in the coordinates of the polygon corners, i.e. pixel (row, col) covers the
+        area [col, col+1) x [row, row+1) (see :py:func:`samuroi.util.rasterize.polygon_pixels`).
+
+        :return: tuple (x0, y0, x1, y1), or None if the mask is empty.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def contains(self, x, y):
+        """
+        Test whether a point lies within the mask.
+
+        :param x: the x coordinate, in the same coordinates as :py:func:`samuroi.masks.mask.Mask.bounding_box`.
+        :param y: the y coordinate.
+        :return: True if the point lies within the mask.
+        """
+        raise NotImplementedError()
+
     @abstractmethod
     def to_hdf5(self, f):
         """
@@ -2,6 +2,8 @@ from .mask import Mask
 
 
 class PixelMask(Mask):
+    overlay_normalized = False
+
     def __init__(self, name=None, xy=None, x=None, y=None):
         super(PixelMask, self).__init__(name=name)
         # use private variables and properties because masks should be either immutable or use changed signal.
@@ -31,6 +33,48 @@ class PixelMask(Mask):
             for name, dataset in f['pixels'].iteritems():
                 yield PixelMask(name=name, x=dataset.value[:, 0], y=dataset.value[:, 1])
 
+    @staticmethod
+    def to_table(masks):
+        """
+        Consolidate the given pixel masks into one table (see :py:class:`samuroi.h5store.H5Store`).
+
+        :param masks: list of pixel masks.
+        :return: dictionary with the arrays `names`, `indptr` and `xy`, the pixels of mask i are `xy[indptr[i]:indptr[i+1]]`.
+        """
+        import numpy
+        return dict(names=numpy.array([m.name for m in masks], dtype='S'),
+                    indptr=numpy.cumsum([0] + [len(m.x) for m in masks]),
+                    xy=numpy.concatenate([numpy.column_stack((m.x, m.y)) for m in masks] +
+                                         [numpy.empty(shape=(0, 2), dtype=int)]))
+
+    @staticmethod
+    def from_table(table):
+        """
+        Create pixel masks from a table as written by :py:func:`samuroi.masks.pixel.PixelMask.to_table`.
+
+        :param table: dictionary like object (e.g. a hdf5 group) holding the arrays of the table.
+        :return: generator over the masks.
+        """
+        names, indptr, xy = table['names'][...], table['indptr'][...], table['xy'][...]
+        for i, name in enumerate(names):
+            pixels = xy[indptr[i]:indptr[i + 1]]
+            yield PixelMask(name=name.decode(), x=pixels[:, 0], y=pixels[:, 1])
+
+    def sparse_weights(self, shape):
+        import numpy
+        indices = numpy.ravel_multi_index((self.__y, self.__x), shape)
+        return indices, numpy.ones(shape=len(indices), dtype=float)
+
+    def bounding_box(self):
+        import numpy
+        if len(self.__x) == 0:
+            return None
+        return numpy.min(self.__x), numpy.min(self.__y), numpy.max(self.__x) + 1, numpy.max(self.__y) + 1
+
+    def contains(self, x, y):
+        import numpy
+        return bool(numpy.any((numpy.floor(x) == self.__x) & (numpy.floor(y) == self.__y)))
+
     def __call__(self, data, mask):
         # get a view on the data for own pixels. shape N x T where N is number of pixels
         data_p = data[self.__y, self.__x, :]
@@ -2,15 +2,24 @@ import numpy
 
 from .mask import Mask
 from ..util.event import Event
+from ..util.rasterize import polygon_pixels, point_in_polygon
 
 class PolygonMask(Mask):
     """
     A mask that is defined by the corners of a polygon
     """
 
-    def __init__(self, outline, name=None):
+    def __init__(self, outline, name=None, pixels=None):
+        """
+        :param outline: Nx2 array with the x,y coordinates of the corners of the polygon.
+        :param name: the name of the mask.
+        :param pixels: optional precalculated pixel weights as returned by
+                       :py:func:`samuroi.util.rasterize.polygon_pixels`, e.g. from rasterizing many polygons in one batch.
+        """
         super(PolygonMask, self).__init__(name=name)
         self.__outline = outline
+        # the cached pixel weights in sparse form, None if they need to be calculated
+        self.__pixels = pixels
         self.changed = Event()
 
     @property
@@ -19,15 +28,26 @@ class PolygonMask(Mask):
 
     @property
     def lowerleft(self):
-        return numpy.min(self.outline, axis=0).astype(int)
+        return numpy.floor(numpy.min(self.outline, axis=0)).astype(int)
 
     @property
     def upperright(self):
-        return numpy.max(self.outline, axis=0).astype(int) + 1
+        return numpy.floor(numpy.max(self.outline, axis=0)).astype(int) + 1
+
+    def bounding_box(self):
+        if len(self.outline) == 0:
+            return None
+        (x0, y0), (x1, y1) = numpy.min(self.outline, axis=0), numpy.max(self.outline, axis=0)
+        return x0, y0, x1, y1
+
+    def contains(self, x, y):
+        return point_in_polygon(self.outline, x, y)
 
     def move(self, offset):
         self.__outline[:, 0] += offset[0]
         self.__outline[:, 1] += offset[1]
+        # the weights need to be recalculated for the new position
+        self.__pixels = None
         self.changed(self)
 
     def to_hdf5(self, f):
@@ -41,41 +61,71 @@ class PolygonMask(Mask):
             for name, dataset in f['polygons'].iteritems():
                 yield PolygonMask(name=name, outline=dataset.value)
 
-    @property
-    def weights(self):
-        """Generate the weight mask of the rectangular area covering the given polygon."""
-        # shift the polygon such that ll is the new origin
-        spoly = self.outline - self.lowerleft
+    @staticmethod
+    def to_table(masks):
+        """
+        Consolidate the given polygon masks into one table (see :py:class:`samuroi.h5store.H5Store`).
+
+        :param masks: list of polygon masks.
+        :return: dictionary with the arrays `names`, `indptr` and `outline`, the corners of polygon i are
+                 `outline[indptr[i]:indptr[i+1]]`.
+        """
+        return dict(names=numpy.array([m.name for m in masks], dtype='S'),
+                    indptr=numpy.cumsum([0] + [len(m.outline) for m in masks]),
+                    outline=numpy.concatenate([m.outline for m in masks] + [numpy.empty(shape=(0, 2), dtype=float)]))
 
-        # width and height of roi
-        W, H = (self.upperright - self.lowerleft)
+    @staticmethod
+    def from_table(table):
+        """
+        Create polygon masks from a table as written by :py:func:`samuroi.masks.polygon.PolygonMask.to_table`.
 
-        from PIL import Image, ImageDraw
-        mimg = Image.new('I', (W * 10, H * 10), 0)
-        l = [(r[0] * 10, r[1] * 10) for r in spoly]
-        ImageDraw.Draw(mimg).polygon(xy=l, outline=False, fill=1)
+        :param table: dictionary like object (e.g. a hdf5 group) holding the arrays of the table.
+        :return: generator over the masks.
+        """
+        names, indptr, outline = table['names'][...], table['indptr'][...], table['outline'][...]
+        for i, name in enumerate(names):
+            yield PolygonMask(name=name.decode(), outline=outline[indptr[i]:indptr[i + 1]].copy())
 
-        # create a numpy array of the image where the extra resolution pixels are wrapped into extra dimensions
-        mimg = numpy.array(mimg).reshape((H, 10, W, 10))
+    @property
+    def pixels(self):
+        """
+        The non zero pixel weights of the polygon in sparse form. The weights are calculated once and cached until the
+        polygon is moved.
+
+        :return: tuple (lowerleft, shape, indices, weights), where indices are flat indices into the bounding box of
+                 given shape, whose origin is lowerleft.
+        """
+        if self.__pixels is None:
+            self.__pixels = polygon_pixels([self.outline])[0]
+        return self.__pixels
 
-        return mimg.sum(axis=1).sum(axis=-1).astype(float) / 100.
+    @property
+    def weights(self):
+        """The weight mask of the rectangular area covering the given polygon."""
+        lowerleft, shape, indices, values = self.pixels
+        weights = numpy.zeros(shape=shape, dtype=float)
+        weights.flat[indices] = values
+        return weights
+
+    def __image_pixels(self, shape):
+        """
+        Get the row and column indices and weights of all pixels of the polygon that lie inside an image of given shape.
+        """
+        lowerleft, bbox, indices, weights = self.pixels
+        rows, cols = numpy.unravel_index(indices, bbox)
+        rows = rows + lowerleft[1]
+        cols = cols + lowerleft[0]
+        inside = (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+        return rows[inside], cols[inside], weights[inside]
+
+    def sparse_weights(self, shape):
+        rows, cols, weights = self.__image_pixels(shape)
+        return numpy.ravel_multi_index((rows, cols), shape), weights
 
     def __call__(self, data, mask=None):
-        # get the rectangular fov that fully covers a polygon
-        rowslice = slice(max(self.lowerleft[1], 0), min(self.upperright[1], data.shape[0]))
-        colslice = slice(max(self.lowerleft[0], 0), min(self.upperright[0], data.shape[1]))
-        # get a view on the data of interest
-        dataview = data[rowslice, colslice]
-        Cs, Rs = (self.upperright - self.lowerleft)
-        Cl, Rl = self.lowerleft
-        weightmask = self.weights[max(-Rl, 0):min(Rs, data.shape[0] - Rl), max(-Cl, 0):min(Cs, data.shape[1] - Cl)]
-
-        if mask is None:
-            doi = weightmask[..., numpy.newaxis] * dataview
-            weight = weightmask.sum()
-        else:
-            mask = mask[rowslice, colslice]
-            doi = weightmask[..., numpy.newaxis] * mask[..., numpy.newaxis] * dataview
-            weight = (weightmask * mask).sum()
-
-        return doi.sum(axis=0).sum(axis=0) / weight
+        rows, cols, weights = self.__image_pixels(data.shape[0:2])
+        if mask is not None:
+            weights = weights * mask[rows, cols]
+
+        # the data of all pixels of the polygon, shape N x T where N is number of pixels
+        return numpy.dot(weights, data[rows, cols]) / weights.sum()
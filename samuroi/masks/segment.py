@@ -1,16 +1,24 @@
 from .mask import Mask
 
 from ..util.branch import Branch
+from ..util.rasterize import polygon_pixels
 
 
 class SegmentMask(Mask):
-    def __init__(self, data, parent):
+    def __init__(self, data, parent, pixels=None):
+        """
+        :param data: the record array of the segment, or a :py:class:`samuroi.util.branch.Branch` object to wrap.
+        :param parent: the :py:class:`samuroi.masks.branch.BranchMask` the segment belongs to.
+        :param pixels: optional precalculated pixel coverage of the outline (see
+                       :py:func:`samuroi.util.rasterize.polygon_pixels`).
+        """
         super(SegmentMask, self).__init__()
-        self.branch = Branch(data=data)
+        # wrap branch objects directly, such that their memoized outline is reused
+        self.branch = data if isinstance(data, Branch) else Branch(data=data)
         self.parent = parent
 
         from .polygon import PolygonMask
-        self.__polygon = PolygonMask(outline=self.outline)
+        self.__polygon = PolygonMask(outline=self.outline, pixels=pixels)
 
     @property
     def outline(self):
@@ -29,6 +37,15 @@ class SegmentMask(Mask):
     def __call__(self, data, mask):
         return self.__polygon(data, mask)
 
+    def sparse_weights(self, shape):
+        return self.__polygon.sparse_weights(shape)
+
+    def bounding_box(self):
+        return self.__polygon.bounding_box()
+
+    def contains(self, x, y):
+        return self.__polygon.contains(x, y)
+
     def move(self, offset):
         """Move the segment don't trigger any event since this will be handled by the parent branch object."""
         new_x = self.data['x'] + offset[0]
@@ -47,8 +64,10 @@ class SegmentMask(Mask):
         i = self.parent.segments.index(self)
 
         # split segment and convert new branch objects into segments
-        subsegments = [SegmentMask(data=s.data, parent=self.parent)
-                       for s in self.branch.split(nsegments=nsegments, length=length, k=k, s=s)]
+        branches = self.branch.split(nsegments=nsegments, length=length, k=k, s=s)
+        # rasterize the outlines of all new segments in one batch
+        pixels = polygon_pixels([b.outline for b in branches])
+        subsegments = [SegmentMask(data=b, parent=self.parent, pixels=p) for b, p in zip(branches, pixels)]
 
         # insert new items into list at correct position, i.e. replace self
         self.parent.segments[i:i + 1] = subsegments
@@ -1,38 +1,68 @@
 import numpy
+import weakref
 
 from .mask import Mask
+from ..util.layout import is_frame_major, frames
 
 
 class Segmentation(Mask):
     """
     Represent a full segmentation of the 2D array. The segmentation should be immutable.
-    Maybe a special handling for index 0 would be nice?!?
+    Pixels with index 0 are considered as background and do not belong to any child.
     """
 
+    overlay_normalized = False
+
     class Child(Mask):
-        """A proxy object that implements the mask interface but is just a facade around one index of the segmentation"""
+        """
+        A proxy object that implements the mask interface but is just a facade around one index of the segmentation.
+        The pixels of the child are a view into the label index of the parent segmentation.
+        """
+
+        overlay_normalized = False
 
-        def __init__(self, parent, index):
+        def __init__(self, parent, index, row, position):
             Mask.__init__(self, name=parent.name + ": " + str(index))
             self.__index = index
             self.__parent = parent
-            self.__y, self.__x = numpy.where(parent.data == index)
+            # the row of the child in the label index of the parent
+            self.__row = row
+            # the position of the child in the list of children of the parent
+            self.__position = position
 
         def __call__(self, data, mask):
-            # get a view on the data for own pixels. shape N x T where N is number of pixels
-            data_p = data[self.__y, self.__x, :]
-            # get a view on the mask for own pixels. shape N x 1 for broadcasting
-            mask_p = mask[self.__y, self.__x].reshape(-1, 1)
+            # the traces of all children are calculated together and cached by the parent
+            return self.__parent.traces(data, mask)[self.__position]
+
+        def sparse_weights(self, shape):
+            indices = numpy.ravel_multi_index((self.y, self.x), shape)
+            return indices, numpy.ones(shape=len(indices), dtype=float)
+
+        def bounding_box(self):
+            y, x = numpy.unravel_index(self.pixels, self.__parent.data.shape)
+            if len(x) == 0:
+                return None
+            return x.min(), y.min(), x.max() + 1, y.max() + 1
 
-            return (data_p * mask_p).mean(axis=0)
+        def contains(self, x, y):
+            return self.__parent.label_at(x, y) == self.__index
+
+        @property
+        def pixels(self):
+            """The flat indices of all pixels of the child within the segmentation data (view into the label index)."""
+            return self.__parent.label_pixels(self.__row)
 
         @property
         def x(self):
-            return self.__x
+            return numpy.unravel_index(self.pixels, self.__parent.data.shape)[1]
 
         @property
         def y(self):
-            return self.__y
+            return numpy.unravel_index(self.pixels, self.__parent.data.shape)[0]
+
+        @property
+        def index(self):
+            return self.__index
 
         @property
         def parent(self):
@@ -45,9 +75,30 @@ class Segmentation(Mask):
 
         self.__data = data
 
-        indices = numpy.unique(data)
+        # build an index of the pixels of each label in one pass (compressed sparse row layout):
+        # the pixels of label self.__labels[i] are self.__pixels[self.__indptr[i]:self.__indptr[i+1]]
+        # the flat data, since numpy 2 returns the inverse with the shape of the input
+        self.__labels, inverse = numpy.unique(numpy.ravel(data), return_inverse=True)
+        counts = numpy.bincount(inverse, minlength=len(self.__labels))
+        self.__indptr = numpy.r_[0, numpy.cumsum(counts)]
+        # a stable sort keeps the pixels of each label in row major order
+        self.__pixels = numpy.argsort(inverse, kind='mergesort')
 
-        self.__children = [Segmentation.Child(self, i) for i in indices if not i == 0]
+        rows = numpy.flatnonzero(self.__labels != 0)
+        self.__children = [Segmentation.Child(self, self.__labels[row], row, position)
+                           for position, row in enumerate(rows)]
+
+        # cache of the last calculated traces, see Segmentation.traces
+        self.__cache = None
+
+    def label_pixels(self, row):
+        """
+        Get the pixels of the label with given row in the label index.
+
+        :param row: the row in the label index, i.e. the position of the label in the sorted unique labels.
+        :return: 1D array of flat pixel indices, a view into the label index.
+        """
+        return self.__pixels[self.__indptr[row]:self.__indptr[row + 1]]
 
     @property
     def children(self):
@@ -58,7 +109,81 @@ class Segmentation(Mask):
         return self.__data
 
     def __call__(self, data, mask):
-        return numpy.zeros(dtype=float, shape=[data.shape[-1]])
+        """
+        The trace of the segmentation is the average over all pixels which belong to any child, i.e. all non
+        background pixels.
+        """
+        self.traces(data, mask)
+        return self.__cache[-1]
+
+    def label_at(self, x, y):
+        """
+        Get the label of the pixel at the given point.
+
+        :return: the label, or 0 (background) if the point lies outside of the segmentation.
+        """
+        row, col = int(numpy.floor(y)), int(numpy.floor(x))
+        if 0 <= row < self.__data.shape[0] and 0 <= col < self.__data.shape[1]:
+            return self.__data[row, col]
+        return 0
+
+    def bounding_box(self):
+        return 0, 0, self.__data.shape[1], self.__data.shape[0]
+
+    def contains(self, x, y):
+        return self.label_at(x, y) != 0
+
+    def sparse_weights(self, shape):
+        indices = numpy.flatnonzero(numpy.ravel(self.__data) != 0)
+        return indices, numpy.ones(shape=len(indices), dtype=float)
+
+    def traces(self, data, mask, blocksize=None):
+        """
+        Calculate the traces of all children in one labeled reduction. The pixels of the data are sorted by label,
+        and summed up per label with one call of `numpy.add.reduceat` per block of frames.
+
+        The result is cached for the given data and mask objects, such that the children can look up their trace
+        instead of calculating it one by one.
+
+        :param data: the video data, any array-like object which supports slicing along the last axis.
+        :param mask: a 2D mask array with same shape as video resolution.
+        :param blocksize: the number of frames per block, defaults to process all frames at once.
+        :return: 2D numpy array with shape (len(children), T), holding the trace of each child in a row.
+        """
+        if self.__cache is not None:
+            dataref, maskref, traces, aggregate = self.__cache
+            if dataref() is data and maskref() is mask:
+                return traces
+
+        T = data.shape[-1]
+        if blocksize is None:
+            blocksize = max(T, 1)
+
+        # the overlay of the pixels sorted by label
+        mask_p = numpy.ravel(mask)[self.__pixels]
+        counts = numpy.diff(self.__indptr)
+        # skip the background label
+        rows = numpy.flatnonzero(self.__labels != 0)
+
+        traces = numpy.empty(shape=(len(rows), T), dtype=float)
+        aggregate = numpy.empty(shape=T, dtype=float)
+        for start in range(0, T, blocksize):
+            stop = min(start + blocksize, T)
+            block = data[..., start:stop]
+            if is_frame_major(block):
+                # get the contiguous frames of the block sorted by label, shape B x N where N is number of pixels
+                frames_p = numpy.reshape(frames(block), (stop - start, -1))[:, self.__pixels]
+                sums = numpy.add.reduceat(frames_p * mask_p, self.__indptr[:-1], axis=1).T[rows]
+            else:
+                # get the data of the block sorted by label, shape N x B where N is number of pixels
+                data_p = numpy.reshape(block, (-1, stop - start))[self.__pixels]
+                sums = numpy.add.reduceat(data_p * mask_p[:, numpy.newaxis], self.__indptr[:-1], axis=0)[rows]
+            traces[:, start:stop] = sums / counts[rows, numpy.newaxis]
+            aggregate[start:stop] = sums.sum(axis=0) / counts[rows].sum()
+
+        # only keep weak references to not keep the video data alive
+        self.__cache = (weakref.ref(data), weakref.ref(mask), traces, aggregate)
+        return traces
 
     def to_hdf5(self, f):
         if 'segmentations' not in f:
@@ -74,4 +199,28 @@ class Segmentation(Mask):
                 seg = Segmentation(name=name, data=data)
                 yield seg
 
+    @staticmethod
+    def to_table(masks):
+        """
+        Consolidate the given segmentations into one table (see :py:class:`samuroi.h5store.H5Store`).
+
+        :param masks: list of segmentations, which all need to have the same shape.
+        :return: dictionary with the arrays `names` and `labels`, the latter with shape (N,Y,X) holding the label images.
+        """
+        return dict(names=numpy.array([m.name for m in masks], dtype='S'),
+                    labels=numpy.array([m.data for m in masks]))
+
+    @staticmethod
+    def from_table(table):
+        """
+        Create segmentations from a table as written by :py:func:`samuroi.masks.segmentation.Segmentation.to_table`.
+
+        :param table: dictionary like object (e.g. a hdf5 group) holding the arrays of the table.
+        :return: generator over the masks.
+        """
+        names, labels = table['names'][...], table['labels']
+        for i, name in enumerate(names):
+            # load the label images one at a time
+            yield Segmentation(name=name.decode(), data=labels[i])
+
 
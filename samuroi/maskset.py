@@ -1,6 +1,8 @@
 from .util.event import Event
+from .util.spatialindex import GridIndex
 
 from collections import MutableSet
+from functools import partial
 from cached_property import cached_property
 
 
@@ -14,11 +16,23 @@ class MaskSet(MutableSet):
         - `__len__`
         - `add()`
         - `discard()`
+
+    The bounding boxes of the masks and their children are kept in a spatial index (see
+    :py:class:`samuroi.util.spatialindex.GridIndex`), which gets updated by the `added`, `removed` and `changed`
+    events. Use :py:func:`samuroi.maskset.MaskSet.query` and :py:func:`samuroi.maskset.MaskSet.at` for region queries
+    and picking, their costs do not depend on the number of masks far away.
     """
 
     def __init__(self, iterable=[]):
         self.__items = dict()
 
+        self.__index = GridIndex()
+        # the masks registered in the index for each mask (itself and its children), and the changed handlers
+        self.__indexed = {}
+        self.__handlers = {}
+        self.added.append(self.__on_added)
+        self.removed.append(self.__on_removed)
+
         for i in iterable:
             self.add(i)
 
@@ -85,6 +99,59 @@ class MaskSet(MutableSet):
         if emit:
             self.removed(elem)
 
+    def __on_added(self, mask):
+        self.__update_index(mask)
+        if hasattr(mask, "changed"):
+            # the changed events of the masks get triggered with or without the mask as argument
+            self.__handlers[mask] = partial(self.__on_changed, mask)
+            mask.changed.append(self.__handlers[mask])
+
+    def __on_changed(self, mask, *args):
+        # the mask might have moved or got new children
+        self.__update_index(mask)
+
+    def __on_removed(self, mask):
+        if mask in self.__handlers:
+            mask.changed.remove(self.__handlers.pop(mask))
+        for m in self.__indexed.pop(mask, []):
+            self.__index.discard(m)
+
+    def __update_index(self, mask):
+        for m in self.__indexed.pop(mask, []):
+            self.__index.discard(m)
+        indexed = [mask] + list(getattr(mask, "children", []))
+        for m in indexed:
+            bbox = m.bounding_box()
+            if bbox is not None:
+                self.__index.add(m, bbox)
+        self.__indexed[mask] = indexed
+
+    def query(self, bbox):
+        """
+        Find the masks (including children) whose bounding box intersects the given box, e.g. for a rubber band
+        selection or for neighbour lookups.
+
+        :param bbox: tuple (x0, y0, x1, y1) in the coordinates of :py:func:`samuroi.masks.mask.Mask.bounding_box`.
+        :return: list of masks.
+        """
+        return self.__index.query(bbox)
+
+    def at(self, x, y):
+        """
+        Find the masks (including children) which contain the given point, e.g. for picking.
+
+        :param x: the x coordinate, in the coordinates of :py:func:`samuroi.masks.mask.Mask.bounding_box`.
+        :param y: the y coordinate.
+        :return: list of masks, sorted by the area of their bounding boxes, i.e. children come before their parents.
+        """
+        masks = [mask for mask in self.__index.query((x, y, x, y)) if mask.contains(x, y)]
+
+        def area(mask):
+            x0, y0, x1, y1 = self.__index.bounding_box(mask)
+            return (x1 - x0) * (y1 - y0)
+
+        return sorted(masks, key=area)
+
     def types(self):
         """
         Get the set of different types of masks which are in the maskset.
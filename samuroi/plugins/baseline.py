@@ -1,29 +1,95 @@
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
 import numpy
 import scipy
 import scipy.signal
 
+from ..util.layout import is_frame_major, empty_frame_major
+from ..util.rollingpercentile import rolling_percentile
+
 
 def F0(data, mode, **kwargs):
     if mode == "stdv":
         return stdv_F0(data, **kwargs)
     if mode == "median":
-        return median_F0(data)
+        return median_F0(data, **kwargs)
     if mode == "linear_bleech":
-        return linbleeched_F0(data)
+        return linbleeched_F0(data, **kwargs)
+    if mode == "rolling_percentile":
+        return rolling_percentile_F0(data, **kwargs)
     raise Exception("Unknown mode: " + mode)
 
 
-def deltaF(data, mode, windows=None, F0=None, **kwargs):
+def deltaF(data, mode, windows=None, F0=None, out=None, dtype=None, **kwargs):
+    """
+    Calculate deltaF/F0 with the baseline of the given mode. The result is calculated block by block of frames and
+    written into `out`, see :py:func:`samuroi.plugins.baseline.normalize`.
+    """
     if mode == "stdv":
-        return stdv_deltaF(data, F0=F0, **kwargs)
+        return stdv_deltaF(data, F0=F0, windows=windows, out=out, dtype=dtype, **kwargs)
     if mode == "median":
-        return median_deltaF(data)
+        return median_deltaF(data, out=out, dtype=dtype, **kwargs)
     if mode == "linear_bleech":
-        return linbleeched_deltaF(data, F0=F0)
+        return linbleeched_deltaF(data, F0=F0, out=out, dtype=dtype, **kwargs)
+    if mode == "rolling_percentile":
+        return rolling_percentile_deltaF(data, F0=F0, out=out, dtype=dtype, **kwargs)
     raise Exception("Unknown mode: " + mode)
 
 
-def stdv_F0(data, windows=None):
+def normalize(data, f0, out=None, dtype=None, blocksize=None):
+    """
+    Calculate :math:`(F-F_0)/F_0` block by block of frames and write the result into a destination. Only one block of
+    the data and of F0 is in memory at once, hence the data and the destination can be lazy or memory mapped (e.g. a
+    :py:class:`samuroi.plugins.tif.TiffStack`, a numpy memmap or a hdf5 dataset). Pass the data itself as destination
+    to normalize in place, which requires floating point data.
+
+    .. code-block:: python
+
+        # write float32 deltaF/F0 into a hdf5 dataset
+        out = f.create_dataset('deltaF', shape=data.shape, dtype='float32')
+        normalize(data, lambda start, stop: F0[..., numpy.newaxis], out=out)
+
+    :param data: 3D array-like object with shape (Y,X,T).
+    :param f0: callable f0(start, stop) which returns F0 for the frames start:stop, broadcastable to the shape
+               (Y,X,stop-start) of the block.
+    :param out: the destination with the same shape as data, which supports assignment of blocks `out[...,start:stop]`.
+                If None, a new array is allocated, with the same memory layout as the data.
+    :param dtype: the floating point dtype of the calculation and of the newly allocated destination. Defaults to the
+                  dtype of out, or to the dtype numpy would choose for the calculation.
+    :param blocksize: the number of frames per block, defaults to blocks of about 64 MiB.
+    :return: the destination.
+    """
+    Y, X, T = data.shape
+    if dtype is None:
+        if out is not None:
+            dtype = out.dtype
+        else:
+            dtype = numpy.result_type(data.dtype, numpy.asarray(f0(0, min(T, 1))).dtype)
+            if dtype.kind != 'f':
+                dtype = float
+    dtype = numpy.dtype(dtype)
+    if dtype.kind != 'f':
+        raise ValueError("deltaF/F0 needs a floating point dtype and destination, got " + str(dtype))
+    if out is None:
+        if is_frame_major(data):
+            out = empty_frame_major(shape=data.shape, dtype=dtype)
+        else:
+            out = numpy.empty(shape=data.shape, dtype=dtype)
+    if blocksize is None:
+        blocksize = max(1, 2 ** 26 // max(1, Y * X * dtype.itemsize))
+
+    for start in range(0, T, blocksize):
+        stop = min(start + blocksize, T)
+        block = numpy.array(data[..., start:stop], dtype=dtype)
+        f = f0(start, stop)
+        block -= f
+        block /= f
+        out[..., start:stop] = block
+    return out
+
+
+def stdv_F0(data, windows=None, workers=None):
     """
     Calculate the baseline for each pixel of data.
     Subdivides data in blocks of B frames and calculate the standard deviation for each block.
@@ -31,40 +97,82 @@ def stdv_F0(data, windows=None):
     The above is done on a per pixel basis. I.e. different pixels can have the mean calculated for
     different blocks.
 
+    The windows are processed one after another, in parallel stripes of rows, and only the running minimum of the
+    variance and the respective mean are kept. Hence no temporaries of the size of the movie are created and lazy data
+    sources (e.g. :py:class:`samuroi.plugins.tif.TiffStack`) are read window by window. The statistics are calculated
+    in the precision of the data, i.e. float32 data is not upcasted.
+
     :param data: NxMxF array, where F is number of frames and NxM is image shape.
     :param windows: The number of windows to use. Default: split the data in blocks of 100 frames. If data.shape[2] mod 100 != 0 drop the frames that are remaining.
+    :param workers: the number of threads, defaults to the number of cores.
     :return: NxM array with baseline for each pixel.
     """
     X, Y, T = data.shape
 
     # default behaviour, cut of overhanging frames
     if windows is None:
-        mod = T % 100
-        windows = T / 100
-        data = data[..., :windows * 100]
-        T = windows * 100
+        windows = max(T // 100, 1)
+        B = T // windows if T < 100 else 100
     elif T % windows != 0:
         raise ValueError("Cannot split data with {} frames into {} equally sized blocks".format(T, windows))
-
-    windowed = numpy.reshape(data, newshape=(X, Y, windows, T / windows))
-
-    # calculate stdv over each block for each pixel
-    stdvs = numpy.std(windowed, axis=3)
-
-    # find the block where the stdv is minimal
-    minblocks = numpy.argmin(stdvs, axis=2)
-
-    # select mean from window with lowes stdv
-    # wee need fancy indexing here to get numpy to accept he index array
-    # returned by numpy.argmin
-    k, j = numpy.meshgrid(numpy.arange(Y), numpy.arange(X))
-
-    means = windowed[j, k, minblocks, :].mean(axis=2)
+    else:
+        B = T // windows
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    dtype = data.dtype if data.dtype.kind == 'f' else numpy.dtype(float)
+    # the running minimum of the variance and the mean of the respective window
+    best_var = numpy.full((X, Y), numpy.inf, dtype=dtype)
+    means = numpy.zeros((X, Y), dtype=dtype)
+
+    # numpy arrays are processed with all windows at once, since the windows are views anyway. Other data sources
+    # are read in chunks of windows of about 64 MiB.
+    if isinstance(data, numpy.ndarray):
+        chunksize = windows
+    else:
+        chunksize = max(1, 2 ** 26 // max(1, X * Y * B * dtype.itemsize))
+    chunksize = min(chunksize, windows)
+
+    # a few stripes per worker to balance the load, small enough to bound the temporaries to about 64 MiB
+    stripesize = max(1, min(-(-X // (4 * workers)), 2 ** 26 // max(1, Y * chunksize * B * dtype.itemsize)))
+    stripes = [slice(start, min(start + stripesize, X)) for start in range(0, X, stripesize)]
+
+    pool = ThreadPool(workers) if workers > 1 else None
+    try:
+        for w0 in range(0, windows, chunksize):
+            w1 = min(w0 + chunksize, windows)
+            block = data[..., w0 * B:w1 * B]
+
+            def update(rows):
+                # the windows of the stripe, shape (rows, Y, windows, B)
+                windowed = numpy.asarray(block[rows], dtype=dtype).reshape((-1, Y, w1 - w0, B))
+                mean = windowed.mean(axis=-1)
+                deviation = windowed - mean[..., numpy.newaxis]
+                numpy.square(deviation, out=deviation)
+                var = deviation.mean(axis=-1)
+                # the first window with minimal stdv wins as for numpy.argmin
+                minblocks = numpy.argmin(var, axis=-1).ravel()
+                pixels = numpy.arange(len(minblocks))
+                var = var.reshape(-1, w1 - w0)[pixels, minblocks].reshape(var.shape[:-1])
+                mean = mean.reshape(-1, w1 - w0)[pixels, minblocks].reshape(mean.shape[:-1])
+                better = var < best_var[rows]
+                best_var[rows][better] = var[better]
+                means[rows][better] = mean[better]
+
+            if pool is None:
+                for rows in stripes:
+                    update(rows)
+            else:
+                pool.map(update, stripes)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
     return means
 
 
-def stdv_deltaF(data, F0=None, windows=None):
+def stdv_deltaF(data, F0=None, windows=None, out=None, dtype=None, workers=None):
     """
     Calculate the fraction dF/F0 for each pixel. F0 is assumed to not depend on time, but on spatial coordinates.
     for the definition of F0 see :py:func:`samuroi.plugins.baseline.stdv_F0`.
@@ -72,14 +180,14 @@ def stdv_deltaF(data, F0=None, windows=None):
     :param data: The video data, shape M,N,T
     :param F0: precalculated F0 or None(default calculate F0 internally)
     :param windows: The number of windows, forwarded to stdv_F0
+    :param out: optional destination, see :py:func:`samuroi.plugins.baseline.normalize`.
+    :param dtype: optional dtype of the result, e.g. float32.
+    :param workers: the number of threads, forwarded to stdv_F0
     :return:  numpy.array with shape M,N,T with values :math:`(F(x,y,t)-F0(x,y))/F0(x,y)`
     """
     if F0 is None:
-        F0 = stdv_F0(data=data, windows=windows)
-    # use numpy broadcasting to do the calculation
-    data = (data - F0[..., numpy.newaxis]) / F0[..., numpy.newaxis]
-
-    return data
+        F0 = stdv_F0(data=data, windows=windows, workers=workers)
+    return normalize(data, lambda start, stop: F0[..., numpy.newaxis], out=out, dtype=dtype)
 
 
 def power_spectrum(data, fs):
@@ -118,67 +226,354 @@ def bandstop(data, fs, start, stop, order = 3):
     return dataf
 
 
-def linbleeched_F0(data):
+def linbleeched_F0(data, model="linear", blocksize=None, workers=None):
     """
     Calculate a linear fit (:math:`y(t)=m t+y_0)` for each pixel, which is assumed to correct for bleeching effects.
 
-    :param data: he video data of shape (M,N,T).
-    :return: tuple (m,y0) with two images each with shape (M,N).
-    """
+    Since the time coordinates are the same for all pixels, the least squares fit follows in closed form from the per
+    pixel sums of :math:`F` and :math:`(t-\\bar t) F`. These are accumulated in a single streaming pass over blocks of
+    frames, in parallel stripes of rows, without copying the data.
 
-    # generate c coordinates
-    x = numpy.arange(data.shape[-1])
-    # reshape the data to two d array, first dimension is pixel index, second dimension is time
-    d = numpy.reshape(data, (data.shape[0] * data.shape[1], data.shape[-1]))
-    # find fit parameters
-    m, y0 = numpy.polyfit(x, d.T, 1)
-    # reshape fit parameters back to image shape
-    return m.reshape(data.shape[0:2]), y0.reshape(data.shape[0:2])
+    With `model="exponential"` the bleaching is modelled as :math:`F_0(t)=a e^{k t}`, which is fitted the same way, as a
+    linear fit to :math:`\\log F`. This requires positive data, pixels with non positive values yield nan.
 
-
-def linbleeched_deltaF(data, F0=None):
+    :param data: he video data of shape (M,N,T).
+    :param model: "linear" or "exponential".
+    :param blocksize: the number of frames per block. Defaults to all frames for numpy arrays, and to blocks of about
+                      64 MiB for other data sources.
+    :param workers: the number of threads, defaults to the number of cores.
+    :return: tuple (m,y0) with two images each with shape (M,N), or (k,a) for the exponential model.
+    """
+    if model not in ("linear", "exponential"):
+        raise Exception("Unknown bleaching model: " + model)
+    Y, X, T = data.shape
+    if blocksize is None:
+        if isinstance(data, numpy.ndarray):
+            blocksize = T
+        else:
+            blocksize = 2 ** 26 // max(1, Y * X * numpy.dtype(data.dtype).itemsize)
+    blocksize = int(max(1, min(blocksize, T)))
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    # the centered time coordinates
+    t = numpy.arange(T) - (T - 1) / 2.
+    # the per pixel sums of F and t F
+    s = numpy.zeros(shape=(Y, X))
+    st = numpy.zeros(shape=(Y, X))
+
+    # a few stripes per worker to balance the load, small enough to bound the temporaries to about 64 MiB
+    stripesize = max(1, min(-(-Y // (4 * workers)), 2 ** 26 // max(1, X * blocksize * 8)))
+    stripes = [slice(start, min(start + stripesize, Y)) for start in range(0, Y, stripesize)]
+
+    pool = ThreadPool(workers) if workers > 1 else None
+    try:
+        for start in range(0, T, blocksize):
+            block = data[..., start:start + blocksize]
+
+            def update(rows):
+                f = numpy.asarray(block[rows])
+                if model == "exponential":
+                    # non positive samples have no logarithm, they turn the fit of their pixel into nan
+                    f = numpy.log(numpy.where(f > 0, f, numpy.nan))
+                elif f.dtype.kind != 'f':
+                    f = f.astype(float)
+                s[rows] += f.sum(axis=-1)
+                st[rows] += f.dot(t[start:start + f.shape[-1]].astype(f.dtype))
+
+            if pool is None:
+                for rows in stripes:
+                    update(rows)
+            else:
+                pool.map(update, stripes)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # the slope and the intercept at t=0
+    m = st / max((t ** 2).sum(), 1.)
+    y0 = s / max(T, 1) - m * (T - 1) / 2.
+    if model == "exponential":
+        return m, numpy.exp(y0)
+    return m, y0
+
+
+def linbleeched_deltaF(data, F0=None, out=None, dtype=None, model="linear", workers=None):
     """
     Assumes that the fluorescence F0 follows linear bleeching (see  :py:func:`samuroi.plugins.baseline.linbleeched_F0`).
     Determines the linear fit parameters m,y0 for :math:`F_0(t) = m f(t)+y_0`. Then uses :math:`F_0(t)` to calculate
-    :math:`(F(t)-F_0(t))/F_0(t)`.
+    :math:`(F(t)-F_0(t))/F_0(t)`. :math:`F_0(t)` is evaluated for one block of frames at a time.
 
     :param data:  The video data of shape (M,N,T).
     :param F0:
+    :param out: optional destination, see :py:func:`samuroi.plugins.baseline.normalize`.
+    :param dtype: optional dtype of the result, e.g. float32.
+    :param model: the bleaching model "linear" or "exponential", see :py:func:`samuroi.plugins.baseline.linbleeched_F0`.
+    :param workers: the number of threads, forwarded to linbleeched_F0
     :return: deltaF/F0 for bleech corrected :math:`F_0(t)`.
     """
     # get fit parameters
     if F0 is None:
-        m, y0 = linbleeched_F0(data)
+        m, y0 = linbleeched_F0(data, model=model, workers=workers)
     else:
         m, y0 = F0
 
-    # get x coordinates
-    x = numpy.arange(data.shape[-1])
-    # do outer product to apply linear drift, then add offset values with new axis, because they don't depend on time
-    f0 = numpy.multiply.outer(m, x) + y0[:, :, numpy.newaxis]
-    # return deltaF/F0
-    return (data - f0) / f0
+    def f0(start, stop):
+        if model == "exponential":
+            return y0[:, :, numpy.newaxis] * numpy.exp(numpy.multiply.outer(m, numpy.arange(start, stop)))
+        # apply the linear drift for the frames of the block, the offset values do not depend on time
+        return numpy.multiply.outer(m, numpy.arange(start, stop)) + y0[:, :, numpy.newaxis]
+
+    return normalize(data, f0, out=out, dtype=dtype)
 
 
-def median_F0(data):
+def median_F0(data, q=50., error=None, blocksize=None, workers=None):
     """
     Calculate a time dependent F0, which does not depend on spatial coordinates.
     The definition is as follows:
     :math:`F_0(t)` = median(:math:`F(x,y,t)` for all x,y)
 
+    The data is read in one pass, block by block of frames, and the median of each frame is selected by partitioning
+    the pixels of the frame, without sorting them. Only a narrow band of values around the median, which is estimated
+    from a sample of the pixels, needs to be partitioned. The frames of a block are processed in parallel.
+
+    Optionally, F0 is approximated from a random subsample of the pixels, the same pixels for all frames. By the
+    Dvoretzky-Kiefer-Wolfowitz inequality, :math:`n = \\ln(200)/(2 \\epsilon^2)` pixels suffice, such that with 99%
+    probability the rank of the result among all pixels of a frame deviates by at most :math:`\\epsilon` times the
+    number of pixels from the rank of the exact percentile. E.g. 26492 pixels for an error of 1%, independent of the
+    image size.
+
+    As for :py:func:`numpy.median`, F0 is nan for frames which contain nan, with a subsample only nan within the
+    sampled pixels counts.
+
     :param data: The video data of shape (M,N,T).
+    :param q: the percentile, between 0 and 100. Defaults to the median.
+    :param error: the tolerated error of the rank as fraction of the number of pixels, e.g. 0.01, or None for the
+                  exact percentile.
+    :param blocksize: the number of frames per block, defaults to blocks of about 64 MiB.
+    :param workers: the number of threads, defaults to the number of cores.
     :return: F0 array of shape (T,).
     """
-    return numpy.median(data.reshape(data.shape[0] * data.shape[1], data.shape[-1]), axis=0)
+    Y, X, T = data.shape
+    dtype = data.dtype if data.dtype.kind == 'f' else numpy.dtype(float)
+    if not 0 <= q <= 100:
+        raise ValueError("The percentile needs to be between 0 and 100.")
+
+    # the subsample of pixels, if the tolerated error does not require more pixels than there are
+    sample = None
+    if error is not None:
+        n = int(numpy.ceil(numpy.log(2 / 0.01) / (2 * float(error) ** 2)))
+        if n < Y * X:
+            pixels = numpy.sort(numpy.random.RandomState(0).choice(Y * X, n, replace=False))
+            sample = numpy.unravel_index(pixels, (Y, X))
+    N = Y * X if sample is None else len(sample[0])
+
+    if blocksize is None:
+        blocksize = 2 ** 26 // max(1, N * numpy.dtype(data.dtype).itemsize)
+    blocksize = int(max(1, min(blocksize, T)))
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    # the order statistics to select, the percentile is interpolated between them as by numpy.percentile
+    position = (N - 1) * (q / 100.)
+    lower = int(numpy.floor(position))
+    upper = min(lower + 1, N - 1)
+    fraction = position - lower
+
+    F0 = numpy.empty(T, dtype=dtype)
+    pool = ThreadPool(workers) if workers > 1 else None
+    try:
+        for start in range(0, T, blocksize):
+            stop = min(start + blocksize, T)
+            block = data[..., start:stop]
+            if sample is not None:
+                block = numpy.asarray(block)[sample]
+            # a copy with one row per frame, which gets partitioned in place
+            frames = numpy.array(block.reshape(N, stop - start).T, dtype=dtype, order='C')
+            chunksize = max(1, -(-len(frames) // (4 * workers)))
+
+            def select(first):
+                chunk = frames[first:first + chunksize]
+                # frames with nan pixels yield nan, as for numpy.median
+                invalid = numpy.isnan(chunk).any(axis=-1)
+                lo, hi = _select(chunk, [lower, upper]).T
+                F0[start + first:start + first + len(lo)] = numpy.where(invalid, numpy.nan, lo + fraction * (hi - lo))
+
+            if pool is None:
+                for first in range(0, len(frames), chunksize):
+                    select(first)
+            else:
+                pool.map(select, range(0, len(frames), chunksize))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return F0
+
+
+def _select(frames, kth):
+    """
+    Select the order statistics kth of each row, as numpy.partition(frames, kth, axis=-1)[:, kth], the rows get
+    partitioned in place.
 
+    The bounds of a narrow band of values around the order statistics are estimated from a sample of each row, as in
+    the Floyd-Rivest algorithm. Then only the values within the band get partitioned, the values below are just
+    counted. Rows where the order statistics turn out to be outside of the band are partitioned completely.
 
-def median_deltaF(data):
+    :param frames: 2D array with one row per frame.
+    :param kth: sorted list of the order statistics to select.
+    :return: 2D array with shape (rows, len(kth)).
+    """
+    P, N = frames.shape
+    # the sample size and the margin of ranks around the order statistics within the sample (about 6 sigma)
+    s = int(N ** (2 / 3.))
+    if s < 1024:
+        frames.partition(kth, axis=-1)
+        return frames[:, kth]
+    margin = int(3 * numpy.sqrt(s)) + 1
+    bounds = [max(0, kth[0] * s // N - margin), min(s - 1, kth[-1] * s // N + margin)]
+    sample = frames[:, numpy.random.RandomState(0).randint(0, N, size=s)]
+    sample.partition(bounds, axis=-1)
+    lo, hi = sample[:, bounds[0]], sample[:, bounds[1]]
+
+    result = numpy.empty(shape=(P, len(kth)), dtype=frames.dtype)
+    for i in range(P):
+        # nan is neither below nor within the band, i.e. it counts as above as for numpy.partition
+        with numpy.errstate(invalid='ignore'):
+            below = frames[i] < lo[i]
+            inband = frames[i] <= hi[i]
+        k = [j - numpy.count_nonzero(below) for j in kth]
+        # the values below are a subset of the values up to the upper bound
+        inband ^= below
+        band = frames[i][inband]
+        if k[0] >= 0 and k[-1] < len(band):
+            band.partition(k)
+            result[i] = band[k]
+        else:
+            frames[i].partition(kth)
+            result[i] = frames[i][kth]
+    return result
+
+
+def median_deltaF(data, out=None, dtype=None, **kwargs):
     """
     Apply the deltaF/F transformation with :math:`F_0` defined as in :py:func:`samuroi.plugins.baseline.median_F0`.
 
     :param data: The video data of shape (M,N,T).
+    :param out: optional destination, see :py:func:`samuroi.plugins.baseline.normalize`.
+    :param dtype: optional dtype of the result, e.g. float32.
+    :param kwargs: q, error, blocksize and workers are forwarded to median_F0.
     :return: deltaF/F0 for median :math:`F_0(t)`.
     """
 
-    f0 = median_F0(data)
-    return (data - f0[numpy.newaxis, numpy.newaxis, :]) / f0[numpy.newaxis, numpy.newaxis, :]
+    f0 = median_F0(data, **kwargs)
+    return normalize(data, lambda start, stop: f0[numpy.newaxis, numpy.newaxis, start:stop], out=out, dtype=dtype)
+
+
+def rolling_percentile_F0(data, window=100, q=10., out=None, dtype=None, blocksize=None, workers=None):
+    """
+    Calculate a time dependent F0 for each pixel, as the q-th percentile of a sliding window of frames, which follows
+    slow drifts of the fluorescence (see :py:func:`samuroi.util.rollingpercentile.rolling_percentile`).
+
+    The data is read in blocks of frames, together with the frames the windows of the block reach into. Each block is
+    processed in parallel stripes of rows, and F0 is written block by block into the destination. The stripes are
+    written directly into numpy destinations, other destinations get one block at a time assigned.
+
+    :param data: The video data of shape (M,N,T).
+    :param window: the number of frames of the sliding window, centered on each frame.
+    :param q: the percentile, between 0 and 100.
+    :param out: the destination with the same shape as data, which supports assignment of blocks `out[...,start:stop]`.
+                If None, a new array is allocated, with the same memory layout as the data.
+    :param dtype: the dtype of the newly allocated destination, defaults to the dtype of floating point data and to
+                  float otherwise.
+    :param blocksize: the number of frames per block. Defaults to all frames for numpy arrays, and to blocks of about
+                      64 MiB for other data sources.
+    :param workers: the number of threads, defaults to the number of cores.
+    :return: F0 array of shape (M,N,T).
+    """
+    Y, X, T = data.shape
+    if dtype is None:
+        dtype = out.dtype if out is not None else data.dtype if data.dtype.kind == 'f' else float
+    dtype = numpy.dtype(dtype)
+    if out is None:
+        if is_frame_major(data):
+            out = empty_frame_major(shape=data.shape, dtype=dtype)
+        else:
+            out = numpy.empty(shape=data.shape, dtype=dtype)
+    if blocksize is None:
+        if isinstance(data, numpy.ndarray):
+            blocksize = T
+        else:
+            blocksize = 2 ** 26 // max(1, Y * X * numpy.dtype(data.dtype).itemsize)
+    blocksize = int(max(1, min(blocksize, T)))
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    window = int(window)
+    h = window // 2
+
+    # a few stripes per worker to balance the load, small enough to bound the temporaries to about 64 MiB
+    stripesize = max(1, min(-(-Y // (4 * workers)), 2 ** 26 // max(1, X * (blocksize + 2 * window) * 8)))
+    stripes = [slice(start, min(start + stripesize, Y)) for start in range(0, Y, stripesize)]
+
+    # numpy destinations get the stripes written directly, unless the frames of later blocks would be overwritten
+    direct = isinstance(out, numpy.ndarray) and not (isinstance(data, numpy.ndarray) and
+                                                     numpy.may_share_memory(out, data))
+
+    pool = ThreadPool(workers) if workers > 1 else None
+    try:
+        for start in range(0, T, blocksize):
+            stop = min(start + blocksize, T)
+            # the frames of the block and the frames its windows reach into
+            lo, hi = max(0, start - h), min(T, stop - 1 - h + window)
+            block = data[..., lo:hi]
+            if direct:
+                f0 = out[..., start:stop]
+            else:
+                f0 = numpy.empty(shape=(Y, X, stop - start), dtype=dtype)
+
+            def update(rows):
+                f0[rows] = rolling_percentile(block[rows], window=window, q=q, start=start - lo, stop=stop - lo)
+
+            if pool is None:
+                for rows in stripes:
+                    update(rows)
+            else:
+                pool.map(update, stripes)
+            if not direct:
+                out[..., start:stop] = f0
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return out
+
+
+def rolling_percentile_deltaF(data, F0=None, window=100, q=10., out=None, dtype=None, workers=None):
+    """
+    Apply the deltaF/F transformation with :math:`F_0` defined as in
+    :py:func:`samuroi.plugins.baseline.rolling_percentile_F0`. If F0 is calculated internally, it is written into the
+    destination first, which then gets normalized in place, i.e. no second array of the size of the data is needed.
+    This is not possible if the data itself is the destination, then F0 is kept in a separate array.
+
+    :param data: The video data of shape (M,N,T).
+    :param F0: precalculated F0 of shape (M,N,T) or None(default calculate F0 internally)
+    :param window: the number of frames of the sliding window, forwarded to rolling_percentile_F0
+    :param q: the percentile, forwarded to rolling_percentile_F0
+    :param out: optional destination, see :py:func:`samuroi.plugins.baseline.normalize`.
+    :param dtype: optional dtype of the result, e.g. float32.
+    :param workers: the number of threads, forwarded to rolling_percentile_F0
+    :return: deltaF/F0 for the running percentile :math:`F_0(t)`.
+    """
+    if F0 is None:
+        if dtype is None and out is None and data.dtype.kind != 'f':
+            dtype = float
+        inplace = out is data or (isinstance(out, numpy.ndarray) and isinstance(data, numpy.ndarray) and
+                                  numpy.may_share_memory(out, data))
+        if inplace:
+            F0 = rolling_percentile_F0(data, window=window, q=q, dtype=dtype, workers=workers)
+        else:
+            F0 = out = rolling_percentile_F0(data, window=window, q=q, out=out, dtype=dtype, workers=workers)
+    return normalize(data, lambda start, stop: F0[..., start:stop], out=out, dtype=dtype)
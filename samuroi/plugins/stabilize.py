@@ -1,5 +1,7 @@
 import numpy
 
+from ..util.layout import frame_major, frames
+
 try:
     import cv2
 except ImportError as e:
@@ -34,6 +36,8 @@ class Stabilization(object):
     def run(self, data, reference = None):
         if data.dtype != '>u1':
             data = (data > numpy.median(data)*1.3).astype('>u1')*255
+        # opencv requires contiguous frames
+        data = frame_major(data)
 
 
         # TODO allow saving the stabilization process
@@ -100,10 +104,11 @@ class Stabilization(object):
         """apply the found transformations to other data data wont be modified"""
         assert(data.shape == self.datashape)
 
-        copy = data.astype(float)
+        # copy into a frame contiguous float array with shape (T,Y,X), such that each frame is a contiguous image
+        copy = frames(data).astype(float, order='C')
 
-        for i in range(1, data.shape[2]):
-            frame = copy[:, :, i].copy()
+        for i in range(1, copy.shape[0]):
             tm = self.transformations[i-1]
-            copy[:, :, i] = cv2.warpAffine(frame, tm, dsize=frame.shape[::-1])
-        return copy.astype(data.dtype)
+            copy[i] = cv2.warpAffine(copy[i], tm, dsize=copy[i].shape[::-1])
+        # return with (Y,X,T) indexing
+        return copy.astype(data.dtype).transpose(1, 2, 0)
@@ -1,3 +1,6 @@
+import re
+import warnings
+
 import numpy
 
 from samuroi.util.branch import Branch
@@ -6,24 +9,72 @@ def load_swc(filename):
     return SWCFile(filename)
 
 
+def read_swc(filename):
+    """
+    Parse the nodes of a swc file with a single vectorized text reader. Comments (starting with #) are ignored. Lines
+    without 7 columns or with values which are not numbers raise an exception which names the line.
+
+    :param filename: the path/filename or an open file object to read.
+    :return: numpy recarray with the fields of :py:attr:`samuroi.plugins.swc.SWCFile.swcformat`.
+    """
+    if hasattr(filename, 'read'):
+        text = filename.read()
+    else:
+        with open(filename, 'rb') as f:
+            text = f.read()
+    if not isinstance(text, str):
+        text = text.decode('latin-1')
+
+    lines = re.sub(r'#.*', '', text).splitlines()
+    counts = numpy.array([len(line.split()) for line in lines], dtype=int)
+    bad = numpy.flatnonzero((counts != 0) & (counts != len(SWCFile.swcformat)))
+    if len(bad) > 0:
+        raise Exception("SWC file needs to have 7 columns, line {}: {!r}".format(bad[0] + 1, lines[bad[0]]))
+
+    try:
+        with warnings.catch_warnings():
+            # the parser stops at the first token which is not a number, some numpy versions warn about it
+            warnings.simplefilter('ignore', DeprecationWarning)
+            values = numpy.fromstring('\n'.join(lines), dtype=float, sep=' ')
+    except ValueError:
+        # newer numpy versions raise instead
+        values = None
+    if values is None or len(values) != counts.sum():
+        for number, line in enumerate(lines):
+            try:
+                [float(token) for token in line.split()]
+            except ValueError:
+                raise Exception("SWC file contains an invalid value, line {}: {!r}".format(number + 1, line))
+        raise Exception("SWC file contains an invalid value.")
+    values = values.reshape(-1, len(SWCFile.swcformat))
+
+    d = numpy.recarray(len(values), dtype=SWCFile.swcformat)
+    for i, (name, kind) in enumerate(SWCFile.swcformat):
+        d[name] = values[:, i]
+    return d
+
+
 class SWCFile(numpy.recarray):
     """
     Subclass of numpy.recarray for swc files.
+
+    The nodes of a branch are consecutive rows, where each node is the parent of the next one. The ids of the nodes do
+    not need to be consecutive or sorted, the parents are looked up by id.
     """
 
     swcformat = [('id',int),('kind',int),('x',float),('y',float),('z',float),
                 ('radius',float),('parent_id',int)]
 
     def __new__(cls, *args,**kwargs):
-        # if no argument is given, create zero sized recarray
-        if len(args) == 0:
-            args = (0,)
+        if len(args) == 0 or args[0] is None:
+            # if no argument is given, create zero sized recarray
+            d = numpy.recarray(0, dtype = SWCFile.swcformat)
         elif type(args[0]) is int:
             # create empty recarray
             d = numpy.recarray(args[0], dtype = SWCFile.swcformat)
         else:
             # create from file or filename
-            d = numpy.recfromtxt(args[0], dtype = SWCFile.swcformat)
+            d = read_swc(args[0])
 
         return d.view(SWCFile)
 
@@ -33,10 +84,10 @@ class SWCFile(numpy.recarray):
         :param filename (str): the path/filename to load.
         """
         self.filename = filename
-        if self['id'][0] != 1:
-            raise Exception("SWC id ordering needs to start with 1.")
-        if not (self['id'][1:] - self['id'][:-1] == 1).all():
-            raise Exception("SWC ids need to be consecutive.")
+        if len(numpy.unique(self['id'])) != len(self):
+            raise Exception("SWC ids need to be unique.")
+        # raise for unknown parents
+        self.parent_indices
 
 
     def __array_finalize__(self, obj):
@@ -44,22 +95,60 @@ class SWCFile(numpy.recarray):
         if obj is None: return
         self.filename = getattr(obj, 'filename', None)
 
+    @property
+    def parent_indices(self):
+        """
+        :return: 1D integer array with the row index of the parent of each node, -1 for root nodes.
+        """
+        ids = numpy.asarray(self['id'])
+        parent_ids = numpy.asarray(self['parent_id'])
+        order = numpy.argsort(ids, kind='mergesort')
+        position = numpy.searchsorted(ids[order], parent_ids).clip(0, max(len(ids) - 1, 0))
+        parents = numpy.where(parent_ids < 0, -1, order[position] if len(ids) > 0 else position)
+        if (ids[parents[parents >= 0]] != parent_ids[parents >= 0]).any():
+            raise Exception("SWC file refers to unknown parent ids.")
+        return parents
+
+    @property
+    def branch_indptr(self):
+        """
+        :return: 1D integer array, the rows of branch i are `indptr[i]:indptr[i+1]`. A new branch starts at each node
+                 whose parent is not the node in the previous row.
+        """
+        n = len(self)
+        starts = numpy.flatnonzero(self.parent_indices != numpy.arange(n) - 1)
+        if n > 0 and (len(starts) == 0 or starts[0] != 0):
+            starts = numpy.r_[0, starts]
+        return numpy.r_[starts, n].astype(int)
+
+    @property
+    def branch_parents(self):
+        """
+        :return: 1D integer array with the index of the parent branch of each branch, i.e. the branch which holds the
+                 parent of its first node, -1 for branches starting at a root node.
+        """
+        indptr = self.branch_indptr
+        parents = self.parent_indices[indptr[:-1]]
+        # the branch index of each node
+        branch = numpy.repeat(numpy.arange(len(indptr) - 1), numpy.diff(indptr))
+        return numpy.where(parents < 0, -1, branch[parents])
+
     @property
     def nbranches(self):
         """
         :return: The number of branches in the file.
         """
-        return (self['parent_id'] == -1).sum()
+        return len(self.branch_indptr) - 1
 
     @property
     def branches(self):
         """
-        :return: A generator object that allows to iterate over all branches.
+        :return: A generator object that allows to iterate over all branches. The data of all branches are views into
+                 one shared array with the fields x, y, z and radius.
         """
-        last_index = 0
-        for index in numpy.flatnonzero(self['id'] != self['parent_id'] + 1):
-            if last_index == index: continue
-            yield Branch(self[last_index:index][['x','y','z','radius']])
-            last_index = index
-        # yield the last branch
-        yield Branch(self[last_index:])
+        records = numpy.empty(len(self), dtype=[('x', float), ('y', float), ('z', float), ('radius', float)])
+        for field in ('x', 'y', 'z', 'radius'):
+            records[field] = self[field]
+        indptr = self.branch_indptr
+        for start, stop in zip(indptr[:-1], indptr[1:]):
+            yield Branch(records[start:stop])
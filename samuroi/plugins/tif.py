@@ -1,7 +1,244 @@
+import struct
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
 import PIL
+import PIL.Image
 import numpy
 
-def load_tif(filename):
+from ..util.layout import empty_frame_major
+
+# the tiff tags required to locate the image data of the pages
+_IMAGE_WIDTH = 256
+_IMAGE_LENGTH = 257
+_BITS_PER_SAMPLE = 258
+_COMPRESSION = 259
+_STRIP_OFFSETS = 273
+_SAMPLES_PER_PIXEL = 277
+_STRIP_BYTE_COUNTS = 279
+_TILE_WIDTH = 322
+_SAMPLE_FORMAT = 339
+
+# map tiff field types to the struct format characters
+_FIELD_TYPES = {1: 'B', 2: 'c', 3: 'H', 4: 'I', 5: 'II', 6: 'b', 7: 'B', 8: 'h', 9: 'i', 10: 'ii', 11: 'f', 12: 'd',
+                16: 'Q', 17: 'q', 18: 'Q'}
+
+# map tiff sample formats to numpy dtype kinds
+_SAMPLE_KINDS = {1: 'u', 2: 'i', 3: 'f'}
+
+
+def read_pages(filename):
+    """
+    Read the image file directories (IFDs) of all pages of a (Big)TIFF file.
+
+    :param filename: the path/filename to read.
+    :return: tuple (byteorder, pages), where byteorder is '<' or '>' and pages is a list with one dictionary per page
+             that maps the tag ids to the (tuple of) tag values.
+    """
+    with open(filename, 'rb') as f:
+        header = f.read(16)
+        byteorder = {b'II': '<', b'MM': '>'}[header[0:2]]
+        version, = struct.unpack(byteorder + 'H', header[2:4])
+        if version == 42:
+            offset, = struct.unpack(byteorder + 'I', header[4:8])
+            count_format, entry_format, next_format, valuesize = 'H', 'HHI', 'I', 4
+        elif version == 43:
+            offset, = struct.unpack(byteorder + 'Q', header[8:16])
+            count_format, entry_format, next_format, valuesize = 'Q', 'HHQ', 'Q', 8
+        else:
+            raise Exception("Not a tiff file: " + filename)
+
+        count_size = struct.calcsize(byteorder + count_format)
+        entry_size = struct.calcsize(byteorder + entry_format) + valuesize
+        next_size = struct.calcsize(byteorder + next_format)
+
+        pages = []
+        while offset != 0:
+            f.seek(offset)
+            count, = struct.unpack(byteorder + count_format, f.read(count_size))
+            entries = f.read(count * entry_size)
+            tags = {}
+            for i in range(count):
+                entry = entries[i * entry_size:(i + 1) * entry_size]
+                tag, fieldtype, n = struct.unpack(byteorder + entry_format, entry[:-valuesize])
+                if fieldtype not in _FIELD_TYPES:
+                    continue
+                fmt = byteorder + _FIELD_TYPES[fieldtype] * n
+                size = struct.calcsize(fmt)
+                if size <= valuesize:
+                    # the value is stored in the entry itself
+                    value = entry[-valuesize:][:size]
+                else:
+                    # the entry holds the offset of the value
+                    position = f.tell()
+                    f.seek(struct.unpack(byteorder + next_format, entry[-valuesize:])[0])
+                    value = f.read(size)
+                    f.seek(position)
+                tags[tag] = struct.unpack(fmt, value)
+            pages.append(tags)
+            offset, = struct.unpack(byteorder + next_format, f.read(next_size))
+    return byteorder, pages
+
+
+class TiffStack(object):
+    """
+    A lazy, read only array-like view on a multi page tif file with shape (Y,X,T), which can be used as
+    :py:attr:`samuroi.SamuROIData.data`. Creating the stack only reads the page headers of the file, not the image data.
+
+    Uncompressed stacks are memory mapped directly, using the page offsets from the image file directories. Then the
+    stack is backed by a frame contiguous numpy memmap (see :py:func:`samuroi.util.layout.frame_major`) and indexing
+    does not copy data. Compressed stacks are decoded page by page on demand, the most recently used pages are kept in
+    a LRU cache.
+
+    The time index of a key is applied first, i.e. `stack[rows, cols]` yields an array of shape (len(rows),T) as it
+    would for a numpy array, but all three indices are not broadcasted against each other.
+    """
+
+    def __init__(self, filename, cachesize=128):
+        """
+        :param filename: the path/filename to load.
+        :param cachesize: the maximal number of decoded pages to keep in memory for compressed stacks.
+        """
+        self.filename = filename
+        self.cachesize = cachesize
+        self.__cache = OrderedDict()
+        self.__image = None
+
+        byteorder, pages = read_pages(filename)
+        first = pages[0]
+        X, = first[_IMAGE_WIDTH]
+        Y, = first[_IMAGE_LENGTH]
+        self.__shape = (Y, X, len(pages))
+        bits = first.get(_BITS_PER_SAMPLE, (1,))[0]
+        kind = _SAMPLE_KINDS.get(first.get(_SAMPLE_FORMAT, (1,))[0], 'u')
+        self.__dtype = numpy.dtype('{}{}{}'.format(byteorder, kind, bits // 8)) if bits % 8 == 0 else None
+
+        # the memmap of the uncompressed data, None if the pages need to be decoded
+        self.__memmap = None
+        self.__pages = None
+        if self.__dtype is not None and all(self.__mappable(page, X, Y, bits) for page in pages):
+            offsets = numpy.array([page[_STRIP_OFFSETS][0] for page in pages], dtype=numpy.int64)
+            framesize = X * Y * self.__dtype.itemsize
+            if len(offsets) > 1 and (numpy.diff(offsets) == offsets[1] - offsets[0]).all() \
+                    and offsets[1] - offsets[0] >= framesize:
+                # the pages are equally spaced within the file, map them all at once as (T,Y,X) array
+                raw = numpy.memmap(filename, dtype=numpy.uint8, mode='r', offset=offsets[0],
+                                   shape=((len(offsets) - 1) * (offsets[1] - offsets[0]) + framesize,))
+                strides = (offsets[1] - offsets[0], X * self.__dtype.itemsize, self.__dtype.itemsize)
+                frames = numpy.lib.stride_tricks.as_strided(raw.view(self.__dtype), shape=(len(offsets), Y, X),
+                                                            strides=strides)
+                self.__memmap = frames.transpose(1, 2, 0)
+            else:
+                # map each page on its own
+                raw = numpy.memmap(filename, dtype=numpy.uint8, mode='r')
+                self.__pages = [raw[o:o + framesize].view(self.__dtype).reshape(Y, X) for o in offsets]
+
+    @staticmethod
+    def __mappable(page, X, Y, bits):
+        """Check whether the page is stored uncompressed in one contiguous block with the same format as the first."""
+        if page.get(_COMPRESSION, (1,))[0] != 1 or page.get(_SAMPLES_PER_PIXEL, (1,))[0] != 1:
+            return False
+        if _TILE_WIDTH in page or page[_IMAGE_WIDTH][0] != X or page[_IMAGE_LENGTH][0] != Y:
+            return False
+        if page.get(_BITS_PER_SAMPLE, (1,))[0] != bits or _STRIP_OFFSETS not in page:
+            return False
+        offsets = numpy.array(page[_STRIP_OFFSETS])
+        counts = numpy.array(page[_STRIP_BYTE_COUNTS])
+        return (offsets[1:] == offsets[:-1] + counts[:-1]).all() and counts.sum() == X * Y * bits // 8
+
+    @property
+    def shape(self):
+        return self.__shape
+
+    @property
+    def ndim(self):
+        return 3
+
+    @property
+    def dtype(self):
+        if self.__dtype is None:
+            self.__dtype = self.page(0).dtype
+        return self.__dtype
+
+    @property
+    def memmapped(self):
+        """Flag whether the pages of the stack are memory mapped, or need to be decoded."""
+        return self.__memmap is not None or self.__pages is not None
+
+    def __len__(self):
+        return self.__shape[0]
+
+    def page(self, t):
+        """
+        Get a single page of the stack.
+
+        :param t: the index of the page.
+        :return: 2D numpy array with shape (Y,X).
+        """
+        if self.__memmap is not None:
+            return self.__memmap[..., t]
+        if self.__pages is not None:
+            return self.__pages[t]
+
+        if t in self.__cache:
+            # mark the page as most recently used
+            page = self.__cache.pop(t)
+        else:
+            if self.__image is None:
+                self.__image = PIL.Image.open(self.filename)
+            self.__image.seek(t)
+            page = numpy.array(self.__image)
+            if len(self.__cache) >= self.cachesize:
+                self.__cache.popitem(last=False)
+        self.__cache[t] = page
+        return page
+
+    def __getitem__(self, key):
+        if self.__memmap is not None:
+            return self.__memmap[key]
+
+        # normalize the key to a tuple of three indices
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = next(i for i, k in enumerate(key) if k is Ellipsis)
+            key = key[:i] + (slice(None),) * (4 - len(key)) + key[i + 1:]
+        key = key + (slice(None),) * (3 - len(key))
+
+        # load the requested pages into a frame contiguous block
+        times = numpy.arange(self.__shape[2])[key[2]]
+        block = numpy.array([self.page(t) for t in numpy.atleast_1d(times)]).reshape(
+            (-1,) + self.__shape[0:2]).transpose(1, 2, 0)
+        block = block[key[0], key[1]]
+        return block[..., 0] if numpy.ndim(times) == 0 else block
+
+    def __array__(self, dtype=None):
+        data = self[...]
+        return data if dtype is None else data.astype(dtype)
+
+
+def load_tif(filename, frame_major=False, lazy=False, workers=1, progress=None):
+    """
+    Load a multi page tif file.
+
+    With more than one worker the pages are decoded in a thread pool and written directly into the preallocated output
+    array. The page decoders of PIL release the GIL, hence loading of compressed stacks scales with the number of cores.
+    The result is identical to the serial loader.
+
+    :param filename: the path/filename to load.
+    :param frame_major: flag whether the returned data should have frame contiguous memory layout
+                        (see :py:func:`samuroi.util.layout.frame_major`), which makes copying the pages into it cheap.
+    :param lazy: if True, return a :py:class:`samuroi.plugins.tif.TiffStack` which memory maps or decodes the pages on
+                 demand instead of loading the whole file.
+    :param workers: the number of threads used to decode the pages.
+    :param progress: optional callback `progress(loaded, total)` which gets called from the calling thread whenever a
+                     batch of pages was loaded.
+    :return: numpy array with shape (Y,X,T), or the lazy stack.
+    """
+    if lazy:
+        return TiffStack(filename)
+
     img = PIL.Image.open(filename)
     X,Y = img.size
     T = img.n_frames
@@ -9,8 +246,50 @@ def load_tif(filename):
     # workaround to get the dtype
     foo = numpy.array(img)
 
-    data = numpy.ndarray(shape=(Y, X, T), dtype=foo.dtype)
-    for i in range(T):
-        img.seek(i)
-        data[:, :, i] = numpy.array(img)
+    if frame_major:
+        data = empty_frame_major(shape=(Y, X, T), dtype=foo.dtype)
+    else:
+        data = numpy.ndarray(shape=(Y, X, T), dtype=foo.dtype)
+
+    if workers <= 1:
+        for i in range(T):
+            img.seek(i)
+            data[:, :, i] = numpy.array(img)
+            if progress is not None:
+                progress(i + 1, T)
+        return data
+
+    # index the pages once, uncompressed pages can then be copied from the memory map without PIL
+    stack = TiffStack(filename)
+
+    # each thread keeps its own image object, since PIL images can not be shared between threads. Seeking forward is
+    # cheap, because every image remembers the positions of the pages it has seen.
+    local = threading.local()
+
+    def load(pages):
+        if stack.memmapped:
+            for i in pages:
+                data[:, :, i] = stack.page(i)
+        else:
+            if not hasattr(local, "img"):
+                local.img = PIL.Image.open(filename)
+            for i in pages:
+                local.img.seek(i)
+                data[:, :, i] = numpy.array(local.img)
+        return len(pages)
+
+    # split the stack into consecutive batches of pages, a few per worker to balance the load
+    batchsize = max(1, T // (workers * 8))
+    batches = [range(start, min(start + batchsize, T)) for start in range(0, T, batchsize)]
+
+    pool = ThreadPool(workers)
+    try:
+        loaded = 0
+        for n in pool.imap_unordered(load, batches):
+            loaded += n
+            if progress is not None:
+                progress(loaded, T)
+    finally:
+        pool.close()
+        pool.join()
     return data
@@ -1,12 +1,11 @@
 import numpy
-import skimage
-
-import skimage.filters
-import skimage.morphology
 
 from cached_property import cached_property
 from .maskset import MaskSet
 from .util.event import Event
+from .util import layout
+from .util.threshold import ThresholdOverlay
+from .util.projection import projections, max_projection
 
 
 class SamuROIData(object):
@@ -43,34 +42,104 @@ class SamuROIData(object):
     In this manner GUI updates and other custom tasks can be completely separated from the data structure.
     """
 
-    def __init__(self, data, morphology=None):
+    def __init__(self, data, morphology=None, frame_major=False):
         """
         This function will set up the underlying data structure. If no morphology is provided, the morphology array will
-        be generated as `numpy.max(data,axis=-1)`, i.e. a maximum projection over data along the time axis.
+        be generated as the maximum projection over data along the time axis on first access (see
+        :py:func:`samuroi.util.projection.max_projection`). Until then, also the threshold and overlay are not calculated.
         :param data:
-        :param morphology: This can either be a 2D numpy array with the same shape as the video, or None.
+        :param morphology: This can either be a 2D numpy array with the same shape as the video, the name of one of the
+                           :py:attr:`samuroi.SamuROIData.projections` (e.g. "correlation"), or None.
+        :param frame_major: flag whether the data should be stored frame contiguous (see
+                            :py:attr:`samuroi.SamuROIData.frame_major`).
+        """
+        self.frame_major = frame_major
+        """
+        Flag whether in memory data is stored frame contiguous, i.e. in (T,Y,X) memory layout while still being indexed
+        as (Y,X,T) (see :py:func:`samuroi.util.layout.frame_major`). This makes access to whole frames (display,
+        registration) fast, while trace extraction picks the respective fast path for either layout.
         """
+
+        # morphology, threshold and overlay are initialized on first access if no morphology is given
+        self.__morphology = None
+        self.__overlays = None
+        self.__threshold = None
+        self.__overlay = None
+
+        self.__masks = MaskSet()
+        # the mask tables of a lazily loaded hdf5 file, which get instantiated on first access of the masks
+        self.__pending = []
+        # the hdf5 file which is kept open for lazily loaded data
+        self.__h5file = None
+
+        # create the trace extractor before any other component connects to the mask events, such that the compiled
+        # weights are up to date when other components get notified
+        self.traceextractor
+        self.tracecache
+
         self.postprocessor = self.no_postprocessor
 
         # call the property setter which will initialize the mean data and threshold value
         self.data = data
 
-        if morphology is None:
-            self.morphology = numpy.max(data, axis=-1)
-        else:
+        # without a given morphology, the maximum projection is calculated on first access
+        if morphology is not None:
             self.morphology = morphology
 
         # todo: the active frame is merely a utility to synchronize widgets. maybe it should go to the gui...
         self.active_frame = 0
 
-    @cached_property
+    @property
     def masks(self):
         """
         A joined set of all masks of type :py:class:`samuroi.maskset.MaskSet`.
         Use `masks.remove(some_mask)` and `masks.add(some_mask)` to manipulate the set.
         Insertions and removements will trigger events that can be connected to.
         """
-        return MaskSet()
+        while len(self.__pending) > 0:
+            type, table = self.__pending.pop(0)
+            for m in type.from_table(table):
+                self.__masks.add(m)
+        return self.__masks
+
+    @cached_property
+    def traceextractor(self):
+        """
+        The :py:class:`samuroi.traceextractor.TraceExtractor` which calculates the traces of all masks in
+        :py:attr:`samuroi.SamuROIData.masks` in one batch.
+        """
+        from .traceextractor import TraceExtractor
+        return TraceExtractor(self)
+
+    @cached_property
+    def tracecache(self):
+        """
+        The :py:class:`samuroi.tracecache.TraceCache` which holds the raw and postprocessed traces of the masks. Use it
+        instead of calculating traces directly, such that all consumers share the traces.
+        """
+        from .tracecache import TraceCache
+        return TraceCache(self)
+
+    @cached_property
+    def projections(self):
+        """
+        The summary images of the data along time (maximum, mean, standard deviation, variance, sum and local
+        correlation image), calculated in one streaming pass (see :py:func:`samuroi.util.projection.projections`).
+        Use them as morphology or as input of the mask generators. Changing the data will discard them. The costly
+        correlation image is None, unless it was requested by setting the morphology to "correlation".
+
+        :type: :py:class:`samuroi.util.projection.Projections`
+        """
+        return projections(self.data, correlation=False)
+
+    @cached_property
+    def h5store(self):
+        """
+        The :py:class:`samuroi.h5store.H5Store` which writes this object into hdf5 files and keeps track of changes for
+        incremental saves.
+        """
+        from .h5store import H5Store
+        return H5Store(self)
 
     @cached_property
     def data_changed(self):
@@ -188,7 +257,12 @@ class SamuROIData(object):
 
     @data.setter
     def data(self, d):
+        # only convert arrays that are already in memory, lazy data sources (e.g. memmaps) are used as they are
+        if self.frame_major and type(d) is numpy.ndarray:
+            d = layout.frame_major(d)
         self.__data = d
+        # discard the projections of the old data
+        self.__dict__.pop('projections', None)
 
         self.data_changed()
 
@@ -196,20 +270,35 @@ class SamuROIData(object):
     def morphology(self):
         """
         An image which describes the static morphology. A good choice is to use the maximum projection over the non
-        normalized data.
+        normalized data, or the local correlation image to highlight active regions.
         :getter: obtain the morphology image.
-        :setter: set the morphology image, will trigger the :py:attr:`samuroi.SamuROIData.morphology_changed` event.
+        :setter: set the morphology image, or the name of one of the :py:attr:`samuroi.SamuROIData.projections` to use
+                 as morphology. Will trigger the :py:attr:`samuroi.SamuROIData.morphology_changed` event.
         :type: 2D numpy array with same image shape as data.
         """
+        if self.__morphology is None:
+            # the deferred maximum projection should not override a threshold which was set in the meantime
+            self.__set_morphology(max_projection(self.data), threshold=self.__threshold is None)
         return self.__morphology
 
     @morphology.setter
     def morphology(self, morphology):
+        self.__set_morphology(morphology)
+
+    def __set_morphology(self, morphology, threshold=True):
+        if isinstance(morphology, str):
+            if morphology == "correlation" and getattr(self.__dict__.get('projections'), 'correlation', None) is None:
+                # the local correlation image is only calculated on request
+                self.__dict__['projections'] = projections(self.data)
+            morphology = getattr(self.projections, morphology)
         if (morphology.shape != self.data.shape[0:2]):
             raise Exception("Invalid morphology shape.")
         self.__morphology = morphology
-        # choose some appropriate new threshold value
-        self.threshold = numpy.percentile(self.morphology.flatten(), q=90)
+        # the elevation map and the memorized overlays depend on the morphology only
+        self.__overlays = ThresholdOverlay(morphology)
+        if threshold:
+            # choose some appropriate new threshold value, percentile partitions a copy of the image instead of sorting it
+            self.threshold = numpy.percentile(morphology, q=90)
         self.morphology_changed()
 
     @property
@@ -222,6 +311,9 @@ class SamuROIData(object):
         :setter: Set the overlay to given binary mask. This will trigger overlay_changed.
         :type: numpy.ndarray(dtype=bool,shape=self.data.shape[0:2])
         """
+        if self.__overlay is None:
+            # initialize the deferred morphology and threshold
+            self.morphology
         return self.__overlay
 
     @overlay.setter
@@ -247,20 +339,27 @@ class SamuROIData(object):
                     turn will trigger overlay_changed.
         :type: float
         """
+        if self.__threshold is None:
+            # initialize the deferred morphology
+            self.morphology
         return self.__threshold
 
     @threshold.setter
     def threshold(self, t):
         self.__threshold = t
         self.threshold_changed()
-        elevation_map = skimage.filters.sobel(self.morphology)
-
-        markers = numpy.zeros_like(self.morphology)
-        markers[self.morphology < self.threshold] = 1
-        markers[self.morphology > self.threshold * 1.1] = 2
-        segmentation = skimage.morphology.watershed(elevation_map, markers)
+        self.overlay = self.overlays(t)
 
-        self.overlay = segmentation == 2
+    @property
+    def overlays(self):
+        """
+        The :py:class:`samuroi.util.threshold.ThresholdOverlay` object which maps threshold values to overlays for the
+        present morphology. Use it to get the overlays for other thresholds without changing the overlay.
+        """
+        if self.__overlays is None:
+            # initialize the deferred morphology
+            self.morphology
+        return self.__overlays
 
     @property
     def no_postprocessor(self):
@@ -292,16 +391,20 @@ class SamuROIData(object):
         self.postprocessor_changed()
 
     def save_hdf5(self, filename, mask=True, pixels=True, branches=True, circles=True, polygons=True, data=False,
-                  traces=True, segmentations=True):
+                  traces=True, segmentations=True, compression=None, incremental=True):
         """
+        Save into the versioned, chunked hdf5 layout described in :py:class:`samuroi.h5store.H5Store`.
         The structure of the hdf5 file will be as follows:
 
         - overlay (dataset, optional, binary mask defined by threshold value, threshold is stored as attribute)
-        - data (dataset, optional, the full 3D dataset from which the traces were generated)
-        - branches/circles... (groups holding different kinds of datasets for masks)
-        - traces (group that holds a hierarchy for the traces.)
+        - data (dataset, optional, the full 3D dataset from which the traces were generated, chunked along time)
+        - masks/branches, masks/circles... (groups holding one consolidated table for each kind of masks)
+        - traces (group that holds the 2D dataset of all traces, one row per mask, and the names of the rows. The
+          linescan of a branch are the rows of its segments.)
+
+        Saving again into the same file only rewrites the masks and traces which changed since the last save.
 
-        :param filename: filename to use, suffix ".h5" will be added if missing.
+        :param filename: filename to use.
         :param mask: flag whether mask should be stored in file.
         :param pixels:
         :param branches:
@@ -310,54 +413,13 @@ class SamuROIData(object):
         :param data: flag whether data should be stored in file.
         :param traces:
         :param segmentations:
-        :return:
+        :param compression: the hdf5 compression filter for the data, e.g. "gzip" or "lzf".
+        :param incremental: flag whether only changes since the last save into the same file should be written.
         """
-
-        import h5py
-        f = h5py.File(filename, mode='w')
-        f.clear()
-        if mask:
-            f.create_dataset('overlay', data=self.overlay)
-            f['overlay'].attrs['threshold'] = self.threshold
-
-        if data:
-            f.create_dataset('data', data=self.data)
-
-        if pixels:
-            for m in self.pixelmasks:
-                m.to_hdf5(f)
-
-        if polygons:
-            for m in self.polymasks:
-                m.to_hdf5(f)
-
-        if circles:
-            for m in self.circlemasks:
-                m.to_hdf5(f)
-
-        if branches:
-            for m in self.branchmasks:
-                m.to_hdf5(f)
-
-        if segmentations:
-            for m in self.segmentationmasks:
-                m.to_hdf5(f)
-
-        if traces:
-            f.create_group('traces')
-            for m in self.masks:
-                trace = self.postprocessor(m(self.data, self.overlay))
-                if hasattr(m, "children"):
-                    if 'traces/' + m.name not in f:
-                        f.create_group('traces/' + m.name)
-                    f.create_dataset('traces/' + m.name + '/trace', data=trace)
-                else:
-                    f.create_dataset('traces/' + m.name, data=trace)
-            for m in self.branchmasks:
-                if len(m.children) > 0:
-                    f.create_dataset('traces/' + m.name + '/linescan', data=m.linescan(self.data, self.overlay))
-        # write stuff to disc
-        f.close()
+        flags = dict(pixels=pixels, polygons=polygons, circles=circles, branches=branches, segmentations=segmentations)
+        self.h5store.save(filename, overlay=mask, data=data, traces=traces,
+                          kinds=[kind for kind, flag in flags.items() if flag],
+                          compression=compression, incremental=incremental)
 
     def load_swc(self, swc):
         """
@@ -366,22 +428,37 @@ class SamuROIData(object):
         Branches with only a single coordinate will be loaded as circles.
         Branches with more than one coordinate as "tubes".
 
+        The outlines of all branches are calculated and rasterized in one batch.
+
         :param swc: A object of type :py:class:`samuroi.plugins.swc.SWCFile`.
         """
         # get all parts from the swc file that have at least one segment
         from .masks.circle import CircleMask
         from .masks.branch import BranchMask
-        for b in swc.branches:
+        from .util.branch import Branch
+        from .util.rasterize import polygon_pixels
+        branches = list(swc.branches)
+        tubes = [b for b in branches if len(b) > 1]
+        Branch.memoize_corners(tubes)
+        pixels = iter(polygon_pixels([b.outline for b in tubes]))
+        for b in branches:
             if len(b) > 1:
-                mask = BranchMask(data=b)
+                mask = BranchMask(data=b, pixels=next(pixels))
             else:
-                mask = CircleMask(center=b[['x', 'y']][0], radius=b['radius'][0])
+                mask = CircleMask(center=(b['x'][0], b['y'][0]), radius=b['radius'][0])
             self.masks.add(mask)
 
-    def load_hdf5(self, filename, mask=True, pixels=True, branches=True, circles=True, polygons=True, data=True, segmentations=True):
+    def load_hdf5(self, filename, mask=True, pixels=True, branches=True, circles=True, polygons=True, data=True,
+                  segmentations=True, lazy=False):
         """
         Load data that from hd5 file.
 
+        In lazy mode the file is kept open and the data is a :py:class:`samuroi.h5store.H5DataView` on the stored
+        dataset, which reads chunks of frames on demand. The masks of files written by
+        :py:class:`samuroi.h5store.H5Store` are then instantiated from their tables on first access of
+        :py:attr:`samuroi.SamuROIData.masks`. Hence opening a project does not depend on the size of the movie.
+        While the file is open, save into a different file.
+
         :param filename: The filename/path to read from (include extension)
         :param mask: flag whether to read the mask if it is stored in file.
         :param pixels: flag whether to read the pixel masks if some are stored in file.
@@ -390,27 +467,55 @@ class SamuROIData(object):
         :param polygons: flag whether to read the polygon masks if some are stored in file.
         :param data: flag whether to read the data if it is stored in file.
         :param segmentations: flag whether to read the segmentations if it is stored in file.
+        :param lazy: flag whether to keep the file open and load data and masks on demand.
         """
         from .masks.pixel import PixelMask
         from .masks.branch import BranchMask
         from .masks.circle import CircleMask
         from .masks.polygon import PolygonMask
         from .masks.segmentation import Segmentation
+        from .h5store import mask_kinds
 
         import h5py
-        with h5py.File(filename, mode='r') as f:
-            if mask:
-                if 'overlay' not in f:
-                    raise Exception("Overlay data not stored in given hd5 file.")
-                self.threshold = f['overlay'].attrs['threshold']
-                if (self.overlay != f['overlay']).any():
-                    print "Warning: overlay threshold does not match with stored binary mask!"
-                self.overlay = f['overlay'].value
+        from .h5store import H5DataView
+
+        if lazy:
+            if self.__h5file is not None:
+                # instantiate the pending masks of the previous file before closing it
+                self.masks
+                self.__h5file.close()
+            self.__h5file = h5py.File(filename, mode='r')
+            f = self.__h5file
+        else:
+            f = h5py.File(filename, mode='r')
+
+        try:
+            # files written by the h5store hold consolidated tables of masks
+            version = f.attrs.get('version', 1)
 
             if data:
                 if 'data' not in f:
                     raise Exception("Data not stored in given hd5 file.")
-                self.data = f['data'].value
+                self.data = H5DataView(f['data']) if lazy else f['data'][...]
+
+            if mask:
+                if 'overlay' not in f:
+                    raise Exception("Overlay data not stored in given hd5 file.")
+                # use the stored overlay instead of recalculating it from the threshold
+                self.__threshold = f['overlay'].attrs['threshold']
+                self.threshold_changed()
+                self.overlay = f['overlay'][...]
+
+            if version >= 2:
+                flags = dict(pixels=pixels, polygons=polygons, circles=circles, branches=branches,
+                             segmentations=segmentations)
+                for kind, type in mask_kinds():
+                    if flags[kind] and 'masks/' + kind in f:
+                        self.__pending.append((type, f['masks/' + kind]))
+                if not lazy:
+                    # instantiate the masks while the file is open
+                    self.masks
+                return
 
             if pixels:
                 for m in PixelMask.from_hdf5(f):
@@ -431,3 +536,6 @@ class SamuROIData(object):
             if segmentations:
                 for m in Segmentation.from_hdf5(f):
                     self.masks.add(m)
+        finally:
+            if not lazy:
+                f.close()
@@ -0,0 +1,215 @@
+from collections import OrderedDict
+from functools import partial
+
+import numpy
+
+
+class TraceCache(object):
+    """
+    Cache the traces of the masks of a :py:class:`samuroi.SamuROIData` object, such that all consumers (trace and raster
+    views, event detection, saving) share the traces instead of recalculating them.
+
+    The cache has two layers: the raw traces as calculated by the :py:class:`samuroi.traceextractor.TraceExtractor`
+    and the traces with the :py:attr:`samuroi.SamuROIData.postprocessor` applied. Missing traces are calculated in one
+    batch. The cache gets invalidated by the events of the segmentation:
+
+    - the `changed` event of a mask drops the traces of the mask and its (former) children.
+    - :py:attr:`samuroi.maskset.MaskSet.removed` drops the traces of the removed mask and its children.
+    - :py:attr:`samuroi.SamuROIData.overlay_changed` updates the raw traces incrementally from the pixels which
+      changed between the old and the new overlay (see
+      :py:func:`samuroi.traceextractor.TraceExtractor.overlay_delta`) and drops the postprocessed traces. Hence
+      tweaking the threshold costs O(changed pixels x T). If most pixels changed, all traces get dropped.
+    - :py:attr:`samuroi.SamuROIData.data_changed` drops all traces.
+    - :py:attr:`samuroi.SamuROIData.postprocessor_changed` drops the postprocessed traces only.
+
+    The total size of the cached traces is bounded, the least recently used traces get evicted first. The cached
+    traces are read only.
+
+    .. code-block:: python
+
+        # a 2D array with the postprocessed traces of the masks, one per row
+        traces = samudata.tracecache.traces(masks)
+        # the raw trace of a single mask
+        trace = samudata.tracecache.trace(mask, postprocessed=False)
+    """
+
+    def __init__(self, segmentation, maxbytes=256 * 2 ** 20):
+        """
+        :param segmentation: the :py:class:`samuroi.SamuROIData` object whose traces should be cached.
+        :param maxbytes: the maximal size of all cached traces in bytes.
+        """
+        self.segmentation = segmentation
+        self.maxbytes = maxbytes
+
+        # map (mask, postprocessed) -> trace, ordered from least to most recently used
+        self.__traces = OrderedDict()
+        self.__nbytes = 0
+
+        # the overlay, data and postprocessor the cached traces belong to
+        self.__overlay = None
+        self.__data = None
+        self.__postprocessor = None
+
+        # the handlers connected to the changed events of the masks
+        self.__handlers = {}
+
+        self.segmentation.masks.added.append(self.on_mask_added)
+        self.segmentation.masks.removed.append(self.on_mask_removed)
+        self.segmentation.overlay_changed.append(self.on_overlay_changed)
+        self.segmentation.data_changed.append(self.clear)
+        self.segmentation.postprocessor_changed.append(self.on_postprocessor_changed)
+
+        for mask in self.segmentation.masks:
+            self.on_mask_added(mask)
+
+    def on_mask_added(self, mask):
+        if hasattr(mask, "changed"):
+            # the changed events of the masks get triggered with or without the mask as argument
+            self.__handlers[mask] = partial(self.on_mask_changed, mask)
+            mask.changed.append(self.__handlers[mask])
+
+    def on_mask_removed(self, mask):
+        if mask in self.__handlers:
+            mask.changed.remove(self.__handlers.pop(mask))
+        self.discard(mask)
+
+    def on_mask_changed(self, mask, *args):
+        self.discard(mask)
+
+    def on_overlay_changed(self):
+        old, new = self.__overlay, self.segmentation.overlay
+        keys = [key for key in self.__traces if not key[1]]
+        self.clear(raw=False)
+        if old is None or old.shape != new.shape or len(keys) == 0 \
+                or 2 * numpy.count_nonzero(old != new) > new.size:
+            self.clear()
+            return
+
+        masks = [mask for mask, postprocessed in keys]
+        extractor = self.segmentation.traceextractor
+        norms = extractor.norms(masks, old)
+        dsums, _ = extractor.overlay_delta(old, new, masks)
+        # the weighted sums are zero if no pixel of the mask was part of the old overlay
+        sums = numpy.array([self.__traces[key] for key in keys]) * norms[:, numpy.newaxis]
+        sums[norms == 0] = 0.
+        # take the new norms exactly instead of accumulating rounding errors of the updates, masks without any pixel
+        # in the new overlay yield nan as when calculated from scratch
+        newnorms = extractor.norms(masks, new)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            traces = (sums + dsums) / newnorms[:, numpy.newaxis]
+        traces[newnorms == 0] = numpy.nan
+        for key, trace in zip(keys, traces):
+            self.__drop(key)
+            self.__insert(key, trace)
+        self.__overlay = new
+
+    def on_postprocessor_changed(self):
+        self.clear(raw=False)
+
+    def clear(self, raw=True):
+        """
+        Drop cached traces.
+
+        :param raw: flag whether the raw traces should be dropped as well, or only the postprocessed traces.
+        """
+        for key in [key for key in self.__traces if raw or key[1]]:
+            self.__drop(key)
+        if raw:
+            self.__overlay = self.__data = None
+        self.__postprocessor = None
+
+    def discard(self, mask):
+        """
+        Drop the cached traces of the mask, its children and all masks which have it as parent (e.g. the segments of a
+        branch which got split again).
+
+        :param mask: the mask whose traces are not valid anymore.
+        """
+        children = set(getattr(mask, "children", []))
+        for key in [key for key in self.__traces
+                    if key[0] is mask or key[0] in children or getattr(key[0], "parent", None) is mask]:
+            self.__drop(key)
+
+    def __drop(self, key):
+        self.__nbytes -= self.__traces.pop(key).nbytes
+
+    def __get(self, key):
+        """Get a cached trace and mark it as most recently used."""
+        trace = self.__traces.pop(key)
+        self.__traces[key] = trace
+        return trace
+
+    def __insert(self, key, trace):
+        # copy the trace, such that it does not keep a larger array alive
+        trace = numpy.array(trace)
+        trace.flags.writeable = False
+        self.__traces[key] = trace
+        self.__nbytes += trace.nbytes
+        while self.__nbytes > self.maxbytes and len(self.__traces) > 0:
+            self.__drop(next(iter(self.__traces)))
+        return trace
+
+    def __validate(self):
+        """Guard against modifications which did not trigger the respective events."""
+        segmentation = self.segmentation
+        if self.__overlay is not segmentation.overlay or self.__data is not segmentation.data:
+            self.clear()
+        elif self.__postprocessor is not segmentation.postprocessor:
+            self.clear(raw=False)
+        self.__overlay = segmentation.overlay
+        self.__data = segmentation.data
+        self.__postprocessor = segmentation.postprocessor
+
+    def traces(self, masks=None, postprocessed=True):
+        """
+        Get the traces of the given masks. Missing traces get calculated in one batch.
+
+        :param masks: an iterable of masks which are part of the maskset, defaults to all masks in the order of
+                      :py:attr:`samuroi.traceextractor.TraceExtractor.masks`.
+        :param postprocessed: flag whether to return the postprocessed or the raw traces.
+        :return: 2D numpy array with one trace per row.
+        """
+        self.__validate()
+        if masks is None:
+            masks = self.segmentation.traceextractor.masks
+        masks = list(masks)
+
+        traces = {}
+        for mask in masks:
+            if (mask, postprocessed) in self.__traces:
+                traces[mask] = self.__get((mask, postprocessed))
+        missing = [mask for mask in OrderedDict.fromkeys(masks) if mask not in traces]
+
+        if len(missing) > 0:
+            raw = {}
+            if postprocessed:
+                for mask in missing:
+                    if (mask, False) in self.__traces:
+                        raw[mask] = self.__get((mask, False))
+            calculate = [mask for mask in missing if mask not in raw]
+            if len(calculate) > 0:
+                for mask, trace in zip(calculate, self.segmentation.traceextractor.traces(masks=calculate)):
+                    raw[mask] = self.__insert((mask, False), trace)
+            if postprocessed:
+                postprocessor = self.segmentation.postprocessor
+                for mask in missing:
+                    traces[mask] = self.__insert((mask, True), postprocessor(raw[mask]))
+            else:
+                traces.update(raw)
+
+        if len(masks) == 0:
+            return numpy.empty(shape=(0, self.segmentation.data.shape[-1]), dtype=float)
+        return numpy.row_stack([traces[mask] for mask in masks])
+
+    def trace(self, mask, postprocessed=True):
+        """
+        Get the trace of a single mask.
+
+        :param mask: a mask which is part of the maskset.
+        :param postprocessed: flag whether to return the postprocessed or the raw trace.
+        :return: 1D numpy array holding the time trace of the mask.
+        """
+        self.__validate()
+        if (mask, postprocessed) in self.__traces:
+            return self.__get((mask, postprocessed))
+        return self.traces([mask], postprocessed=postprocessed)[0]
@@ -0,0 +1,309 @@
+import numpy
+import scipy.sparse
+
+from .util.layout import is_frame_major, frames
+
+
+def _frame_sums(matrix, frames):
+    """
+    Calculate `matrix.dot(frames.T)` for frames with shape (B, N), without copying them into pixel major layout.
+    The frames are processed a few at a time, such that the products of the weights and the pixels of the frames take
+    at most about 64 MiB.
+
+    :param matrix: CSR matrix with shape (M, N).
+    :param frames: 2D array with shape (B, N), i.e. one flattened frame per row.
+    :return: 2D array with shape (M, B).
+    """
+    sums = numpy.zeros(shape=(matrix.shape[0], frames.shape[0]), dtype=float)
+    # numpy.add.reduceat does not handle empty rows
+    nonempty = numpy.flatnonzero(numpy.diff(matrix.indptr))
+    if len(nonempty) > 0:
+        rows = max(1, 2 ** 26 // (8 * len(matrix.indices)))
+        for start in range(0, frames.shape[0], rows):
+            products = frames[start:start + rows, matrix.indices] * matrix.data
+            sums[nonempty, start:start + rows] = numpy.add.reduceat(products, matrix.indptr[nonempty], axis=1).T
+    return sums
+
+
+def _blocksize(data):
+    """
+    The default number of frames per block for streaming the data: blocks of about 64 MiB, which are aligned with the
+    chunks of frames of lazy data sources (e.g. a H5DataView or a h5py dataset), such that each chunk is read only once.
+
+    :param data: array-like with shape (Y,X,T).
+    :return: the number of frames per block.
+    """
+    blocksize = max(1, 2 ** 26 // max(1, data.shape[0] * data.shape[1] * numpy.dtype(data.dtype).itemsize))
+    if not isinstance(data, numpy.ndarray):
+        chunks = getattr(data, 'timechunks', None) or (getattr(data, 'chunks', None) or (None,))[-1]
+        if chunks:
+            blocksize = max(1, blocksize // chunks) * chunks
+    return blocksize
+
+
+class TraceExtractor(object):
+    """
+    Compile all masks of a :py:class:`samuroi.SamuROIData` object into one sparse weight matrix with one row per mask
+    and one column per pixel. The traces of all masks can then be calculated with a single sparse-dense matrix product
+    over the video data, instead of one pass over the data per mask.
+
+    The extractor connects to the :py:attr:`samuroi.maskset.MaskSet.added` and
+    :py:attr:`samuroi.maskset.MaskSet.removed` events as well as to the `changed` events of the masks themselves.
+    When the set of masks changes, only the rows of new or modified masks get recompiled.
+
+    .. code-block:: python
+
+        extractor = TraceExtractor(samudata)
+        # a 2D array with one trace per row, in the order of extractor.masks
+        traces = extractor.traces()
+    """
+
+    def __init__(self, segmentation):
+        """
+        :param segmentation: the :py:class:`samuroi.SamuROIData` object whose masks, data and overlay should be used.
+        """
+        self.segmentation = segmentation
+
+        # cache the sparse weights (indices, weights) for each mask
+        self.__rows = {}
+        # the compiled matrices, None if they need to be recompiled
+        self.__masks = None
+        self.__index = None
+        self.__weights = None
+        self.__columns = None
+        self.__shape = None
+        # the weight matrix multiplied with the overlay it was calculated for
+        self.__masked = None
+        self.__norm = None
+        self.__overlay = None
+
+        self.segmentation.masks.added.append(self.on_mask_added)
+        self.segmentation.masks.removed.append(self.on_mask_removed)
+
+        for mask in self.segmentation.masks:
+            if hasattr(mask, "changed"):
+                mask.changed.append(self.on_mask_changed)
+
+    def on_mask_added(self, mask):
+        if hasattr(mask, "changed"):
+            mask.changed.append(self.on_mask_changed)
+        self.__weights = None
+
+    def on_mask_removed(self, mask):
+        if hasattr(mask, "changed"):
+            mask.changed.remove(self.on_mask_changed)
+        self.__discard(mask)
+        self.__weights = None
+
+    def on_mask_changed(self, mask=None):
+        # some masks trigger their changed event without argument, then only the set of children can have changed
+        if mask is not None:
+            self.__discard(mask)
+        self.__weights = None
+
+    def __discard(self, mask):
+        """Drop the cached rows of the mask and its children."""
+        self.__rows.pop(mask, None)
+        for child in getattr(mask, "children", []):
+            self.__rows.pop(child, None)
+
+    def __compile(self):
+        """Assemble the weight matrix from the cached rows and compile the rows of new or modified masks."""
+        shape = self.segmentation.data.shape[0:2]
+        masks = list(self.segmentation.masks)
+
+        # a different image shape invalidates all flat pixel indices
+        if shape != self.__shape:
+            self.__rows.clear()
+            self.__shape = shape
+
+        # drop rows of masks which are not part of the set anymore, e.g. children of a split branch
+        for mask in set(self.__rows).difference(masks):
+            del self.__rows[mask]
+
+        indptr = numpy.zeros(shape=len(masks) + 1, dtype=int)
+        for i, mask in enumerate(masks):
+            if mask not in self.__rows:
+                self.__rows[mask] = mask.sparse_weights(shape)
+            indptr[i + 1] = indptr[i] + len(self.__rows[mask][0])
+
+        indices = numpy.concatenate([self.__rows[mask][0] for mask in masks] + [numpy.array([], dtype=int)])
+        weights = numpy.concatenate([self.__rows[mask][1] for mask in masks] + [numpy.array([], dtype=float)])
+
+        self.__masks = masks
+        self.__index = {mask: i for i, mask in enumerate(masks)}
+        self.__weights = scipy.sparse.csr_matrix((weights, indices, indptr), shape=(len(masks), shape[0] * shape[1]))
+        self.__columns = None
+        self.__masked = None
+
+    def __apply_overlay(self, overlay):
+        """
+        Multiply the weight matrix with the overlay and calculate the normalization of each row.
+        :return: tuple (masked weight matrix, normalization vector).
+        """
+        masked = self.weights.copy()
+        masked.data *= numpy.ravel(overlay)[masked.indices]
+
+        overlay_normalized = numpy.array([mask.overlay_normalized for mask in self.masks], dtype=bool)
+        norm = numpy.where(overlay_normalized,
+                           numpy.ravel(masked.sum(axis=1)),
+                           numpy.ravel(self.weights.sum(axis=1)))
+        # rows without any pixels (e.g. the segmentation itself) yield zero traces
+        norm[numpy.diff(self.weights.indptr) == 0] = 1.
+        return masked, norm
+
+    def __update(self):
+        """Recompile the weight matrix if masks or the image shape changed."""
+        if self.__weights is None or self.__shape != self.segmentation.data.shape[0:2]:
+            self.__compile()
+
+    @property
+    def masks(self):
+        """The list of masks in the order of the rows of the weight matrix."""
+        self.__update()
+        return self.__masks
+
+    @property
+    def weights(self):
+        """
+        The compiled weight matrix without the overlay applied.
+
+        :type: scipy.sparse.csr_matrix with shape (len(masks), Y*X)
+        """
+        self.__update()
+        return self.__weights
+
+    def __masked_weights(self, overlay=None, masks=None):
+        """Get the weight matrix with the overlay applied and the normalization vector for the given masks."""
+        self.__update()
+        if overlay is None:
+            # the overlay setter always assigns a new array, hence identity tells whether the overlay changed
+            if self.__masked is None or self.__overlay is not self.segmentation.overlay:
+                self.__overlay = self.segmentation.overlay
+                self.__masked, self.__norm = self.__apply_overlay(self.__overlay)
+            masked, norm = self.__masked, self.__norm
+        else:
+            masked, norm = self.__apply_overlay(overlay)
+
+        if masks is not None:
+            rows = [self.__index[mask] for mask in masks]
+            masked, norm = masked[rows], norm[rows]
+        return masked, norm
+
+    def norms(self, masks=None, overlay=None):
+        """
+        Get the normalization of the traces, i.e. the trace of a mask is its weighted pixel sum divided by its norm.
+
+        :param masks: an iterable of masks which are part of the maskset, defaults to all masks.
+        :param overlay: the 2D overlay mask, defaults to the overlay of the segmentation.
+        :return: 1D numpy array with the norm of each mask.
+        """
+        return self.__masked_weights(overlay, masks)[1]
+
+    def overlay_delta(self, old, new, masks=None, data=None):
+        """
+        Calculate how the weighted pixel sums and the norms of the masks change, when the overlay changes from old to
+        new. Only the pixels which differ between both overlays are used, hence the costs are O(changed pixels x T)
+        instead of O(mask pixels x T) for calculating the traces from scratch. The data is streamed in blocks of frames
+        as by :py:func:`samuroi.traceextractor.TraceExtractor.traces`.
+
+        .. code-block:: python
+
+            sums = traces * extractor.norms(masks, old)
+            dsums, dnorms = extractor.overlay_delta(old, new, masks)
+            traces = (sums + dsums) / extractor.norms(masks, new)[:, numpy.newaxis]
+
+        :param old: the 2D overlay the traces were calculated for.
+        :param new: the new 2D overlay.
+        :param masks: an iterable of masks which are part of the maskset, defaults to all masks.
+        :param data: the video data, defaults to the data of the segmentation.
+        :return: tuple (dsums, dnorms) with the change of the weighted sums, shape (len(masks), T), and of the norms.
+        """
+        if data is None:
+            data = self.segmentation.data
+        self.__update()
+        if self.__columns is None:
+            # column slicing is cheap for the compressed column format
+            self.__columns = self.__weights.tocsc()
+
+        old, new = numpy.ravel(old), numpy.ravel(new)
+        changed = numpy.flatnonzero(old != new)
+        # +1 for pixels which got added to the overlay, -1 for removed ones
+        sign = new[changed].astype(float) - old[changed].astype(float)
+
+        weights = self.__columns[:, changed]
+        if masks is not None:
+            weights = weights[[self.__index[mask] for mask in masks]]
+        weights = weights.multiply(sign[numpy.newaxis, :]).tocsr()
+
+        y, x = numpy.unravel_index(changed, self.__shape)
+        T = data.shape[-1]
+        dsums = numpy.empty(shape=(weights.shape[0], T), dtype=float)
+        blocksize = _blocksize(data)
+        for start in range(0, T, blocksize):
+            stop = min(start + blocksize, T)
+            if isinstance(data, numpy.ndarray):
+                values = data[y, x, start:stop]
+            else:
+                # lazy data sources read whole frames anyway and not all of them support fancy indexing of two axes
+                values = numpy.asarray(data[..., start:stop])[y, x]
+            dsums[:, start:stop] = weights.dot(numpy.asarray(values, dtype=float).reshape(len(changed), stop - start))
+
+        overlay_normalized = numpy.array([mask.overlay_normalized for mask in
+                                          (self.masks if masks is None else masks)], dtype=bool)
+        dnorms = numpy.where(overlay_normalized, numpy.ravel(weights.sum(axis=1)), 0.)
+        return dsums, dnorms
+
+    def traces(self, masks=None, data=None, overlay=None, blocksize=None, out=None):
+        """
+        Calculate the traces of the given masks in one go.
+
+        The data is streamed in blocks of frames and the traces are written block by block into the output array. Hence
+        the data can be any array-like object which supports slicing along the last axis (e.g. a h5py dataset or a numpy
+        memmap) and the peak memory is bounded by the size of one block, not by the length of the recording. The output
+        can likewise be a h5py dataset, such that traces of very long recordings never need to fit in memory.
+
+        .. code-block:: python
+
+            with h5py.File("movie.h5", mode='r') as f:
+                traces = extractor.traces(data=f['data'], blocksize=1000)
+
+        :param masks: an iterable of masks which are part of the maskset, defaults to all masks (see
+                      :py:attr:`samuroi.traceextractor.TraceExtractor.masks`).
+        :param data: the video data, defaults to the data of the segmentation.
+        :param overlay: the 2D overlay mask, defaults to the overlay of the segmentation.
+        :param blocksize: the number of frames per block, defaults to blocks of about 64 MiB, which are aligned with the
+                          chunks of frames of lazy data sources.
+        :param out: array-like object with shape (len(masks), T) to write the traces into. Defaults to a new numpy array.
+        :return: the 2D array holding one trace per row, i.e. out if it was given.
+        """
+        if data is None:
+            data = self.segmentation.data
+        masked, norm = self.__masked_weights(overlay, masks)
+
+        T = data.shape[-1]
+        if blocksize is None:
+            blocksize = _blocksize(data)
+        if out is None:
+            out = numpy.empty(shape=(masked.shape[0], T), dtype=float)
+
+        for start in range(0, T, blocksize):
+            stop = min(start + blocksize, T)
+            block = data[..., start:stop]
+            if is_frame_major(block):
+                # the frames are contiguous, shape B x N where N is the number of pixels and B the number of frames
+                sums = _frame_sums(masked, numpy.reshape(frames(block), (stop - start, -1)))
+            else:
+                # shape N x B where N is the number of pixels and B the number of frames in the block
+                sums = masked.dot(numpy.reshape(block, (-1, stop - start)))
+            out[:, start:stop] = sums / norm[:, numpy.newaxis]
+        return out
+
+    def trace(self, mask):
+        """
+        Calculate the trace of a single mask.
+
+        :param mask: a mask which is part of the maskset.
+        :return: 1D numpy array holding the time trace of the mask.
+        """
+        return self.traces(masks=[mask])[0]
@@ -15,6 +15,11 @@
     :undoc-members:
     :show-inheritance:
 
+.. automodule:: samuroi.util.layout
+    :members:
+    :undoc-members:
+    :show-inheritance:
+
 .. automodule:: samuroi.util.maskcreator
     :members:
     :undoc-members:
@@ -35,4 +40,29 @@
     :undoc-members:
     :show-inheritance:
 
+.. automodule:: samuroi.util.projection
+    :members:
+    :undoc-members:
+    :show-inheritance:
+
+.. automodule:: samuroi.util.rasterize
+    :members:
+    :undoc-members:
+    :show-inheritance:
+
+.. automodule:: samuroi.util.rollingpercentile
+    :members:
+    :undoc-members:
+    :show-inheritance:
+
+.. automodule:: samuroi.util.spatialindex
+    :members:
+    :undoc-members:
+    :show-inheritance:
+
+.. automodule:: samuroi.util.threshold
+    :members:
+    :undoc-members:
+    :show-inheritance:
+
 """
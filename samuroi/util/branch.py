@@ -47,52 +47,93 @@ class Branch(object):
         """The radius around the anchor points along the branch. (1D array)"""
         return self.data['radius']
 
+    @property
+    def data(self):
+        """
+        The record array with the fields x, y, z and radius of the center points along the branch. Assign a new array
+        to change the branch, the memoized corners and outline are only valid as long as the data is not modified in
+        place.
+        """
+        return self.__data
+
+    @data.setter
+    def data(self, data):
+        self.__data = data
+        self.__corners = None
+        self.__outline = None
+
     @property
     def corners(self):
         """
         Nx2x2 array, where N is the number of corners.
         The second dimension is for left and right corner.
         The last dimension holds x,y values.
+        The array is memoized until the data changes, hence it is read only.
         """
 
-        if self.nquadrilaterals == 0:
-            raise Exception("Corners can only be calculated for branches with at least 1 segment.")
-        # the corners of the polygons for each element of the segment
-        corners = numpy.empty(shape=(len(self), 2, 2), dtype=float)
-
-        # handle first and last element
-        c0 = numpy.array((self['x'][0], self['y'][0]))
-        c1 = numpy.array((self['x'][1], self['y'][1]))
-
-        corners[0, 0] = c0 + perpedndicular1(c1 - c0) * self['radius'][0]
-        corners[0, 1] = c0 - perpedndicular1(c1 - c0) * self['radius'][0]
+        if self.__corners is None:
+            Branch.memoize_corners([self])
+        return self.__corners
 
-        c0 = numpy.array((self['x'][-1], self['y'][-1]))
-        c1 = numpy.array((self['x'][-2], self['y'][-2]))
-
-        corners[-1, 0] = c0 + perpedndicular1(-c1 + c0) * self['radius'][-1]
-        corners[-1, 1] = c0 - perpedndicular1(-c1 + c0) * self['radius'][-1]
-
-        # handle the intermediate segments
-        for i, (s0, s1, s2) in enumerate(zip(self[0:-2], self[1:-1], self[2:])):
-            c0 = numpy.array((s0['x'], s0['y']))
-            c1 = numpy.array((s1['x'], s1['y']))
-            c2 = numpy.array((s2['x'], s2['y']))
-
-            # perpendicular unit vectors
-            pv01 = perpedndicular1(c1 - c0)
-            pv12 = perpedndicular1(c2 - c1)
+    @staticmethod
+    def memoize_corners(branches):
+        """
+        Calculate the corners of many branches in one vectorized batch and memoize them, e.g. before the outlines of
+        all branches of a reconstruction get rasterized.
 
-            corners[i + 1, 0] = c1 + s1['radius'] * normalize((pv01 + pv12) / 2.)
-            corners[i + 1, 1] = c1 - s1['radius'] * normalize((pv01 + pv12) / 2.)
-        return corners
+        :param branches: iterable of :py:class:`samuroi.util.branch.Branch` objects with at least 2 points each.
+        """
+        branches = [b for b in branches if b.__corners is None]
+        if len(branches) == 0:
+            return
+        counts = numpy.array([len(b) for b in branches], dtype=int)
+        if (counts < 2).any():
+            raise Exception("Corners can only be calculated for branches with at least 1 segment.")
+        ends = numpy.cumsum(counts)
+        starts = ends - counts
+
+        x, y, radius = [numpy.concatenate([numpy.asarray(b[field], dtype=float) for b in branches])
+                        for field in ('x', 'y', 'radius')]
+        centers = numpy.column_stack((x, y))
+        # the perpendicular unit vectors of all segments, including the ones between consecutive branches
+        d = numpy.diff(centers, axis=0)
+        perpendicular = numpy.column_stack((-d[:, 1], d[:, 0]))
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            # the segments between branches may have zero length, they are not used
+            perpendicular /= numpy.linalg.norm(perpendicular, axis=1)[:, numpy.newaxis]
+
+        # the perpendicular vectors of the segments before and after each point. The first and last point of a branch
+        # use the direction of their only segment, the intermediate points the mean direction of both segments.
+        before = numpy.empty(shape=(len(x), 2), dtype=float)
+        after = numpy.empty(shape=(len(x), 2), dtype=float)
+        before[1:] = perpendicular
+        after[:-1] = perpendicular
+        before[starts] = after[starts]
+        after[ends - 1] = before[ends - 1]
+        directions = (before + after) / 2.
+        directions /= numpy.linalg.norm(directions, axis=1)[:, numpy.newaxis]
+        directions *= radius[:, numpy.newaxis]
+
+        # the corners of the polygons for each element of the branches
+        corners = numpy.empty(shape=(len(x), 2, 2), dtype=float)
+        corners[:, 0] = centers + directions
+        corners[:, 1] = centers - directions
+        corners.flags.writeable = False
+        for branch, start, end in zip(branches, starts, ends):
+            branch.__corners = corners[start:end]
 
     @property
     def outline(self):
         """
         Return the corners of the branch in such order that they encode a polygon.
+        The array is memoized until the data changes, hence it is read only.
         """
-        return numpy.row_stack((self.corners[:, 0, :], self.corners[::-1, 1, :]))
+        if self.__outline is None:
+            corners = self.corners
+            outline = numpy.row_stack((corners[:, 0, :], corners[::-1, 1, :]))
+            outline.flags.writeable = False
+            self.__outline = outline
+        return self.__outline
 
     @property
     def length(self):
@@ -104,42 +145,8 @@ class Branch(object):
         return len(self.data)
 
     def split(self, nsegments=2, length=None, k=1, s=0):
-        """Split the branch into segments"""
-        if length is None:
-            sublength = self.length / nsegments  # the target length of the segments
-        else:
-            sublength = float(length)
-
-        # get the data that requires interpolation
-        x, y, z, r = self['x'], self['y'], self['z'], self['radius']
-
-        # the cumulative length
-        t = numpy.r_[0, numpy.cumsum(((x[:-1] - x[1:]) ** 2 + (y[:-1] - y[1:]) ** 2) ** .5)]
-
-        # create interpolation coefficients
-        import scipy.interpolate
-        splinecoeffs, u = scipy.interpolate.splprep([x, y, z, r], u=t, k=k, s=s)
-
-        # create new parametrization array. It is supposed to consist of the old lengths
-        # plus points that cut the length into the proper segment size
-        tnew = t.tolist()
-        # the indices where to split the resulting tnew
-        indices = [0]
-        import bisect
-        for n in range(1, int(self.length / sublength) + 1):
-            index = bisect.bisect_left(tnew, n * sublength)
-            indices.append(index)
-            bisect.insort_left(tnew, n * sublength)
-
-        # append the end index for the last segment if last segment size is larger than eps
-        if tnew[-1] - tnew[-2] > 0.01:
-            indices.append(len(tnew))
-
-        # interpolate the parametrization
-        xn, yn, zn, rn = scipy.interpolate.splev(tnew, splinecoeffs)
-
-        branchgen = lambda i0, i1: Branch(x=xn[i0:i1], y=yn[i0:i1], z=zn[i0:i1], r=rn[i0:i1])
-        return [branchgen(i0, i1 + 1) for i0, i1 in zip(indices[:-1], indices[1:])]
+        """Split the branch into segments (see :py:func:`samuroi.util.branch.split_branches`)."""
+        return split_branches([self], nsegments=nsegments, length=length, k=k, s=s)[0]
 
     def append(self, other, gap=False):
         if not gap:
@@ -169,3 +176,94 @@ class Branch(object):
             corners = self.corners
             for i in range(self.nquadrilaterals):
                 yield numpy.row_stack((corners[i, 0, :], corners[i + 1, 0, :], corners[i + 1, 1, :], corners[i, 1, :]))
+
+
+def split_branches(branches, nsegments=2, length=None, k=1, s=0):
+    """
+    Split many branches into segments in one batch.
+
+    Each branch gets cut into pieces of the target length along its center line, the last piece holds the remainder.
+    The cut points are interpolated with a parametric spline through the center points (x, y, z and radius),
+    parametrized by the cumulative length in the x,y plane. The data of all segments of all branches are views into one
+    shared record array. For the default linear interpolation (k=1, s=0), all cut points of all branches are evaluated
+    at once, otherwise the spline of each branch gets evaluated once at all of its cut points.
+
+    :param branches: iterable of :py:class:`samuroi.util.branch.Branch` objects.
+    :param nsegments: the number of segments per branch, if no length is given.
+    :param length: the length of the segments.
+    :param k: degree of the spline (see :py:func:`scipy.interpolate.splprep`).
+    :param s: smoothness parameter of the spline (see :py:func:`scipy.interpolate.splprep`).
+    :return: list with the list of segments (:py:class:`samuroi.util.branch.Branch` objects) for each branch.
+    """
+    branches = list(branches)
+    if len(branches) == 0:
+        return []
+
+    # the center points of all branches, concatenated
+    counts = numpy.array([len(b) for b in branches], dtype=int)
+    starts = numpy.cumsum(counts) - counts
+    x, y, z, r = [numpy.concatenate([numpy.asarray(b[field], dtype=float) for b in branches])
+                  for field in ('x', 'y', 'z', 'radius')]
+    owner = numpy.repeat(numpy.arange(len(branches)), counts)
+
+    # the cumulative length along each branch
+    steps = numpy.r_[0., numpy.sqrt(numpy.diff(x) ** 2 + numpy.diff(y) ** 2)]
+    steps[starts] = 0.
+    t = numpy.cumsum(steps)
+    t -= t[starts][owner]
+    total = t[starts + counts - 1]
+
+    # the cut points at multiples of the target length
+    if length is None:
+        sublength = total / nsegments
+    else:
+        sublength = numpy.full(len(branches), float(length))
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        ncuts = numpy.floor(total / sublength)
+    ncuts = numpy.where(numpy.isfinite(ncuts), ncuts, 0).astype(int)
+    cut_owner = numpy.repeat(numpy.arange(len(branches)), ncuts)
+    cuts = (numpy.arange(ncuts.sum()) - (numpy.cumsum(ncuts) - ncuts)[cut_owner] + 1) * sublength[cut_owner]
+    # rounding must not move the last cut behind the end of the branch
+    cuts = numpy.minimum(cuts, total[cut_owner])
+
+    # merge the cut points into the parametrization of each branch, cuts go in front of equal parameters
+    tnew = numpy.r_[t, cuts]
+    newowner = numpy.r_[owner, cut_owner]
+    iscut = numpy.r_[numpy.zeros(len(t), dtype=bool), numpy.ones(len(cuts), dtype=bool)]
+    order = numpy.lexsort((~iscut, tnew, newowner))
+    tnew, newowner, iscut = tnew[order], newowner[order], iscut[order]
+    newcounts = counts + ncuts
+    newstarts = numpy.cumsum(newcounts) - newcounts
+
+    # evaluate the splines at the new parametrization
+    if k == 1 and s == 0:
+        # the linear interpolation of all branches at once, the branches are separated along the parameter axis
+        offsets = numpy.cumsum(total + 1.) - (total + 1.)
+        u = tnew + offsets[newowner]
+        up = t + offsets[owner]
+        xn, yn, zn, rn = [numpy.interp(u, up, values) for values in (x, y, z, r)]
+    else:
+        import scipy.interpolate
+        xn, yn, zn, rn = [numpy.empty(len(tnew)) for i in range(4)]
+        for i in range(len(branches)):
+            old = slice(starts[i], starts[i] + counts[i])
+            new = slice(newstarts[i], newstarts[i] + newcounts[i])
+            splinecoeffs, u = scipy.interpolate.splprep([x[old], y[old], z[old], r[old]], u=t[old], k=k, s=s)
+            xn[new], yn[new], zn[new], rn[new] = scipy.interpolate.splev(tnew[new], splinecoeffs)
+
+    # a plain structured array, since slicing record arrays is much slower
+    records = numpy.empty(len(tnew), dtype=[('x', float), ('y', float), ('z', float), ('radius', float)])
+    records['x'], records['y'], records['z'], records['radius'] = xn, yn, zn, rn
+
+    # the segments run from cut to cut, the last one to the end if the remainder is not negligible
+    cutindices = numpy.flatnonzero(iscut).tolist()
+    cutstarts = numpy.r_[0, numpy.cumsum(ncuts)].tolist()
+    newstarts, newcounts, tnew = newstarts.tolist(), newcounts.tolist(), tnew.tolist()
+    segments = []
+    for i in range(len(branches)):
+        first, last = newstarts[i], newstarts[i] + newcounts[i] - 1
+        indices = [first] + cutindices[cutstarts[i]:cutstarts[i + 1]]
+        if newcounts[i] > 1 and tnew[last] - tnew[last - 1] > 0.01:
+            indices.append(last)
+        segments.append([Branch(data=records[i0:i1 + 1]) for i0, i1 in zip(indices[:-1], indices[1:])])
+    return segments
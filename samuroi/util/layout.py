@@ -0,0 +1,49 @@
+import numpy
+
+
+def is_frame_major(data):
+    """
+    Check whether the frames of the given (Y,X,T) data are contiguous in memory, i.e. whether the underlying memory
+    has (T,Y,X) layout.
+
+    :param data: 3D array-like object with shape (Y,X,T).
+    :return: True if data is a numpy array with frame contiguous memory layout.
+    """
+    return isinstance(data, numpy.ndarray) and data.ndim == 3 and numpy.transpose(data, (2, 0, 1)).flags.c_contiguous
+
+
+def frame_major(data):
+    """
+    Store the given data in frame contiguous memory, but keep the (Y,X,T) indexing. The returned array is a transposed
+    view on a (T,Y,X) C-contiguous array. Hence whole frames `data[..., t]` are contiguous, which is the fast path for
+    displaying frames, loading them from files and image registration.
+
+    :param data: 3D array-like object with shape (Y,X,T).
+    :return: numpy array with shape (Y,X,T) and frame contiguous memory. If data already has this layout it is returned
+             as is.
+    """
+    if is_frame_major(data):
+        return data
+    return numpy.ascontiguousarray(numpy.transpose(data, (2, 0, 1))).transpose(1, 2, 0)
+
+
+def empty_frame_major(shape, dtype=float):
+    """
+    Allocate an uninitialized array with frame contiguous memory.
+
+    :param shape: the shape (Y,X,T) of the array.
+    :param dtype: the dtype of the array.
+    :return: numpy array with shape (Y,X,T) and frame contiguous memory.
+    """
+    Y, X, T = shape
+    return numpy.empty(shape=(T, Y, X), dtype=dtype).transpose(1, 2, 0)
+
+
+def frames(data):
+    """
+    Get a (T,Y,X) view on the given (Y,X,T) data. For frame major data this is a C-contiguous view.
+
+    :param data: 3D numpy array with shape (Y,X,T).
+    :return: the data with shape (T,Y,X).
+    """
+    return numpy.transpose(data, (2, 0, 1))
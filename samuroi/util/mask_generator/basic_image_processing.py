@@ -3,6 +3,8 @@ __author__ = 'stephenlenzi'
 import numpy as np
 import cv2
 
+from ..projection import projections
+
 
 def smooth_data(data, iterations=4):
     """smooth image stack
@@ -24,10 +26,13 @@ def std_image(data):
 
     """
     smoothed = smooth_data(data)  # generate smoothened NxMxF array
-    std_image = np.std(smoothed, axis=2)
+    std_image = projections(smoothed, correlation=False).std
     return std_image
 
 
 def sum_image(data):
-    """:param data: NxMxF ndarray, where F is the number of frames and NxM are the image dimensions"""
-    return np.sum(data, axis=2)
+    """
+    :param data: NxMxF ndarray, where F is the number of frames and NxM are the image dimensions
+    :return sum_image: a z-stack sum image, see samuroi.SamuROIData.projections to reuse the summary images of the data
+    """
+    return projections(data, correlation=False).sum
@@ -35,6 +35,8 @@ class MaskCreator(object):
     def __connect(self):
         self.clickslot = self.canvas.mpl_connect('button_press_event', self.__onclick)
         self.keyslot = self.canvas.mpl_connect('key_press_event', self.__onkey)
+        # let the canvas know that its clicks are used for mask creation (see FrameViewCanvas.active_mask_creators)
+        getattr(self.canvas, "active_mask_creators", set()).add(self)
 
     def __disconnect(self):
         if self.keyslot is not None:
@@ -42,6 +44,7 @@ class MaskCreator(object):
             self.canvas.mpl_disconnect(self.keyslot)
             self.keyslot = None
             self.clickslot = None
+            getattr(self.canvas, "active_mask_creators", set()).discard(self)
 
     def onkey(self, event):
         """The slot that will get called when a key is pressed."""
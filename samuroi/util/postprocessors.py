@@ -1,6 +1,8 @@
 import numpy
 import scipy.signal
 
+from .rollingpercentile import rolling_percentile
+
 
 class DetrendPostProcessor(object):
     """Simple linear detrend based on scipy.signal.detrend."""
@@ -20,6 +22,20 @@ class MovingAveragePostProcessor(object):
         return numpy.convolve(trace, numpy.ones(shape=self.N), mode='same') / self.N
 
 
+class RollingPercentilePostProcessor(object):
+    """Calculate deltaF/F0 of the trace, where F0 is the running percentile of a sliding window (see
+    :py:func:`samuroi.util.rollingpercentile.rolling_percentile`)."""
+
+    def __init__(self, N, q=10.):
+        """ N: The size of the window, q: the percentile. """
+        self.N = N
+        self.q = q
+
+    def __call__(self, trace):
+        f0 = rolling_percentile(trace, window=self.N, q=self.q)
+        return (trace - f0) / f0
+
+
 class PostProcessorPipe(object):
     """Allow to concatenate multiple postprocessors."""
 
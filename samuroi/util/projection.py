@@ -0,0 +1,186 @@
+import multiprocessing
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+import numpy
+
+Projections = namedtuple("Projections", ["max", "mean", "std", "var", "sum", "correlation"])
+"""
+The summary images of a video along the time axis: the maximum, mean, standard deviation, variance and sum
+projections, and the local correlation image, i.e. the mean correlation of the trace of each pixel with the traces of
+its (up to 8) neighbouring pixels. The correlation image is None if it was not requested.
+"""
+
+# the offsets (dy,dx) of the neighbours such that each pair of neighbouring pixels occurs once
+_NEIGHBOURS = ((0, 1), (1, -1), (1, 0), (1, 1))
+
+
+def _pairs(shape, dy, dx):
+    """
+    The regions of the pixels and their neighbours at the offset (dy,dx) within an image of the given shape.
+
+    :return: tuple of index tuples (pixels, neighbours).
+    """
+    Y, X = shape
+    return ((slice(0, Y - dy), slice(max(0, -dx), X - max(0, dx))),
+            (slice(dy, Y), slice(max(0, dx), X + min(0, dx))))
+
+
+def _block_statistics(statistics, rows, block, correlation):
+    """
+    Calculate the statistics of a block of frames for some rows.
+
+    :param statistics: tuple of arrays (max, mean, m2, comoments, sum) for the block, which get filled for the rows.
+                       The comoments have shape (4,Y,X), one image per neighbour offset.
+    :param rows: the slice of rows to calculate.
+    :param block: the data of the rows and the row below them (if any) for the block of frames, shape (rows(+1),X,B).
+    :param correlation: flag whether the comoments of neighbouring pixels should be calculated.
+    """
+    maximum, mean, m2, comoments, total = statistics
+    block = numpy.asarray(block)
+    n = rows.stop - rows.start
+    # the sum in the dtype numpy.sum would choose for the data
+    total[rows] = block[0:n].sum(axis=-1)
+    if block.dtype.kind != 'f':
+        # differences of integers could overflow
+        block = block.astype(float)
+
+    # keep the statistics of the block in the precision of the data, the running statistics are double precision
+    block_mean = block.mean(axis=-1)
+    deviation = block - block_mean[..., numpy.newaxis]
+    if correlation:
+        for k, (dy, dx) in enumerate(_NEIGHBOURS):
+            # the last stripe has no row below it
+            m = min(n, deviation.shape[0] - dy)
+            pixels, neighbours = _pairs(deviation.shape[0:2], dy, dx)
+            comoments[k, rows.start:rows.start + m, pixels[1]] = numpy.einsum(
+                'ijt,ijt->ij', deviation[0:m, pixels[1]], deviation[dy:dy + m, neighbours[1]])
+    deviation = deviation[0:n]
+    numpy.square(deviation, out=deviation)
+    m2[rows] = deviation.sum(axis=-1)
+    mean[rows] = block_mean[0:n]
+    maximum[rows] = block[0:n].max(axis=-1)
+
+
+def max_projection(data, blocksize=None):
+    """
+    Calculate the maximum projection along the time axis in a single streaming pass over the data. This is much cheaper
+    than :py:func:`samuroi.util.projection.projections` and keeps the dtype of the data.
+
+    :param data: 3D array-like object with shape (Y,X,T).
+    :param blocksize: the number of frames per block, defaults as for :py:func:`samuroi.util.projection.projections`.
+    :return: 2D array with shape (Y,X) in the dtype of the data.
+    """
+    Y, X, T = data.shape
+    if blocksize is None:
+        if isinstance(data, numpy.ndarray):
+            blocksize = T
+        else:
+            blocksize = 2 ** 26 // max(1, Y * X * numpy.dtype(data.dtype).itemsize)
+    blocksize = int(max(1, min(blocksize, T)))
+
+    maximum = None
+    for start in range(0, T, blocksize):
+        block_maximum = numpy.asarray(data[..., start:start + blocksize]).max(axis=-1)
+        if maximum is None:
+            maximum = block_maximum
+        else:
+            numpy.maximum(maximum, block_maximum, out=maximum)
+    return maximum
+
+
+def projections(data, blocksize=None, workers=None, correlation=True):
+    """
+    Calculate the summary images (see :py:class:`samuroi.util.projection.Projections`) along the time axis in a single
+    streaming pass over the data. The data is read in blocks of frames, such that lazy data sources (e.g.
+    :py:class:`samuroi.plugins.tif.TiffStack` or :py:class:`samuroi.h5store.H5DataView`) are never loaded completely.
+    The statistics of each block are calculated in parallel stripes of rows, and merged into the running statistics
+    with the pairwise update of Chan et al., i.e. Welford's algorithm for blocks of frames, which is numerically stable.
+    The correlation image is merged the same way from the comoments of neighbouring pixels.
+
+    :param data: 3D array-like object with shape (Y,X,T).
+    :param blocksize: the number of frames per block. Defaults to all frames for numpy arrays, since blocks are views
+                      into them anyway, and to blocks of about 64 MiB for other data sources.
+    :param workers: the number of threads, defaults to the number of cores.
+    :param correlation: flag whether to calculate the correlation image.
+    :return: :py:class:`samuroi.util.projection.Projections` with 2D arrays of shape (Y,X), the sum in the dtype
+             numpy.sum would choose for the data and the other images as float.
+    """
+    Y, X, T = data.shape
+    if blocksize is None:
+        if isinstance(data, numpy.ndarray):
+            blocksize = T
+        else:
+            blocksize = 2 ** 26 // max(1, Y * X * numpy.dtype(data.dtype).itemsize)
+    blocksize = int(max(1, min(blocksize, T)))
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    maximum, mean, m2 = numpy.zeros(shape=(Y, X)), numpy.zeros(shape=(Y, X)), numpy.zeros(shape=(Y, X))
+    comoments = numpy.zeros(shape=(len(_NEIGHBOURS), Y, X))
+    # the sum is accumulated in the dtype numpy.sum would choose, e.g. float32 for float32 data
+    sumtype = numpy.zeros(0, dtype=data.dtype).sum().dtype
+    total = numpy.zeros(shape=(Y, X), dtype=sumtype)
+    statistics = (numpy.zeros(shape=(Y, X)), numpy.zeros(shape=(Y, X)), numpy.zeros(shape=(Y, X)),
+                  numpy.zeros(shape=(len(_NEIGHBOURS), Y, X)), numpy.zeros(shape=(Y, X), dtype=sumtype))
+
+    # a few stripes per worker to balance the load, small enough to bound the temporaries to about 64 MiB
+    stripesize = max(1, min(-(-Y // (4 * workers)), 2 ** 26 // (X * blocksize * 8)))
+    stripes = [slice(start, min(start + stripesize, Y)) for start in range(0, Y, stripesize)]
+
+    pool = ThreadPool(workers) if workers > 1 else None
+    try:
+        n = 0
+        for start in range(0, T, blocksize):
+            block = data[..., start:start + blocksize]
+            nb = block.shape[-1]
+
+            def calculate(rows):
+                # include the row below the stripe for the comoments
+                _block_statistics(statistics, rows, block[rows.start:rows.stop + 1], correlation)
+
+            if pool is None:
+                for rows in stripes:
+                    calculate(rows)
+            else:
+                pool.map(calculate, stripes)
+
+            # merge the statistics of the block into the running statistics
+            block_maximum, block_mean, block_m2, block_comoments, block_total = statistics
+            total += block_total
+            delta = block_mean - mean
+            weight = float(n) * nb / (n + nb)
+            if correlation:
+                for k, (dy, dx) in enumerate(_NEIGHBOURS):
+                    pixels, neighbours = _pairs((Y, X), dy, dx)
+                    comoments[k][pixels] += block_comoments[k][pixels] + delta[pixels] * delta[neighbours] * weight
+            mean += delta * (float(nb) / (n + nb))
+            m2 += block_m2 + delta ** 2 * weight
+            if n == 0:
+                maximum[...] = block_maximum
+            else:
+                numpy.maximum(maximum, block_maximum, out=maximum)
+            n += nb
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    var = m2 / max(T, 1)
+    image = None
+    if correlation:
+        # average the correlations with all neighbours, constant traces are uncorrelated
+        image = numpy.zeros(shape=(Y, X))
+        count = numpy.zeros(shape=(Y, X))
+        for k, (dy, dx) in enumerate(_NEIGHBOURS):
+            pixels, neighbours = _pairs((Y, X), dy, dx)
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                r = comoments[k][pixels] / numpy.sqrt(m2[pixels] * m2[neighbours])
+            r[~numpy.isfinite(r)] = 0.
+            image[pixels] += r
+            image[neighbours] += r
+            count[pixels] += 1
+            count[neighbours] += 1
+        image /= numpy.maximum(count, 1)
+
+    return Projections(max=maximum, mean=mean, std=numpy.sqrt(var), var=var, sum=total, correlation=image)
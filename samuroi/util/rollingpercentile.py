@@ -0,0 +1,178 @@
+import numpy
+
+
+def rolling_percentile(traces, window, q=10., start=0, stop=None):
+    """
+    Calculate the q-th percentile of a sliding window along the last axis of the traces.
+
+    The window of sample t covers the samples `t - window // 2` up to `t - window // 2 + window - 1`, it is truncated
+    at both ends of the traces. The percentile is interpolated linearly between the order statistics of the window, as
+    by :py:func:`numpy.percentile`.
+
+    The samples are processed in segments of `window` output samples. The samples which contribute to the windows of a
+    segment (less than two windows) are ranked once, which costs :math:`O(\\log W)` per sample. Then the window is
+    slid over the ranks: each step removes and inserts one rank and moves a pointer to the order statistic across the
+    ranks in between, which are only a few for typical traces. All traces are processed at once, i.e. each step is a
+    few vectorized operations over the traces. For a few traces, e.g. a single one, and small windows, the full windows
+    are rather selected by partitioning copies of the windows, chunk by chunk, which costs :math:`O(W)` per sample.
+
+    .. code-block:: python
+
+        # the running 10th percentile over 100 frames of each trace
+        f0 = rolling_percentile(traces, window=100, q=10)
+
+    :param traces: array-like with shape (...,T).
+    :param window: the number of samples of the window.
+    :param q: the percentile, between 0 and 100.
+    :param start: the first output sample, windows still use all samples of the traces.
+    :param stop: the end of the output samples, defaults to T.
+    :return: array with shape (...,stop-start), in the precision of the traces if they are floating point.
+    """
+    traces = numpy.asarray(traces)
+    window = int(window)
+    if window < 1:
+        raise ValueError("The window needs to contain at least one sample.")
+    if not 0 <= q <= 100:
+        raise ValueError("The percentile needs to be between 0 and 100.")
+    T = traces.shape[-1]
+    stop = T if stop is None else stop
+    dtype = traces.dtype if traces.dtype.kind == 'f' else numpy.dtype(float)
+    f = traces.reshape(-1, T)
+    P = len(f)
+    result = numpy.empty(shape=(P, max(stop - start, 0)), dtype=dtype)
+    if P == 0 or stop <= start:
+        return result.reshape(traces.shape[:-1] + result.shape[-1:])
+
+    if window <= 2 ** 10 and P * window <= 2 ** 14:
+        # for a few traces, the costs of the vectorized steps are dominated by their overhead. Then the full windows
+        # are selected from strided views of the traces, and only the truncated windows at the ends are slid. The
+        # selection costs O(W) per sample, hence large windows are always slid.
+        h = window // 2
+        i0 = min(max(start, h), stop)
+        i1 = max(min(stop, T - window + h + 1), i0)
+        _select_windows(f, window, q, i0, i1, result[:, i0 - start:i1 - start])
+        _slide(f, window, q, start, i0, result[:, :i0 - start])
+        _slide(f, window, q, i1, stop, result[:, i1 - start:])
+    else:
+        _slide(f, window, q, start, stop, result)
+    return result.reshape(traces.shape[:-1] + result.shape[-1:])
+
+
+def _select_windows(f, window, q, start, stop, result):
+    """
+    Select the percentile of the full windows of the outputs start:stop from strided views of the traces, a chunk of
+    outputs at a time.
+
+    :param f: 2D array with one trace per row.
+    :param result: the destination with shape (rows, stop-start).
+    """
+    if stop <= start:
+        return
+    h = window // 2
+    position = (window - 1) * (q / 100.)
+    lower = int(numpy.floor(position))
+    upper = min(lower + 1, window - 1)
+    fraction = position - lower
+
+    f = numpy.ascontiguousarray(f[:, start - h:stop - h + window - 1], dtype=result.dtype)
+    P, n = f.shape
+    windows = numpy.lib.stride_tricks.as_strided(f, shape=(P, n - window + 1, window),
+                                                 strides=(f.strides[0], f.strides[1], f.strides[1]))
+    # chunks of about 16 MiB of window copies
+    chunksize = max(1, 2 ** 24 // (P * window * f.itemsize))
+    for c0 in range(0, stop - start, chunksize):
+        c1 = min(c0 + chunksize, stop - start)
+        chunk = numpy.array(windows[:, c0:c1])
+        chunk.partition([lower, upper], axis=-1)
+        lo, hi = chunk[..., lower], chunk[..., upper]
+        result[:, c0:c1] = lo + fraction * (hi - lo)
+
+
+def _slide(f, window, q, start, stop, result):
+    """
+    Slide the window over the ranks of the samples for the outputs start:stop, see
+    :py:func:`samuroi.util.rollingpercentile.rolling_percentile`.
+
+    :param f: 2D array with one trace per row.
+    :param result: the destination with shape (rows, stop-start).
+    """
+    if stop <= start:
+        return
+    P, T = f.shape
+    dtype = result.dtype
+    h = window // 2
+    # the number of samples in the window of each output sample and the position of the percentile within the window
+    t = numpy.arange(start, stop)
+    counts = numpy.minimum(T, t - h + window) - numpy.maximum(0, t - h)
+    positions = (counts - 1) * (q / 100.)
+    lower = numpy.floor(positions).astype(int)
+    fractions = positions - lower
+    upper = numpy.minimum(lower + 1, counts - 1)
+    # the pointers to the order statistics, the upper one is only needed for interpolation
+    targets = [lower, upper] if (fractions > 0).any() else [lower]
+
+    rows = numpy.arange(P)[:, numpy.newaxis]
+    for s0 in range(start, stop, window):
+        s1 = min(s0 + window, stop)
+        # the samples of all windows of the segment
+        a, b = max(0, s0 - h), min(T, s1 - 1 - h + window)
+        m = b - a
+        segment = numpy.asarray(f[:, a:b], dtype=dtype)
+        order = numpy.argsort(segment, axis=-1)
+        # the sorted values and the rank of each sample, as flat indices into the sorted values of all traces
+        values = segment[rows, order].ravel()
+        ranks = numpy.empty(shape=(P, m), dtype=numpy.intp)
+        ranks[rows, order] = numpy.arange(m)
+        ranks += rows * m
+
+        # the ranks within the window of the first output sample
+        present = numpy.zeros(P * m, dtype=bool)
+        present[ranks[:, :min(T, s0 - h + window) - a].ravel()] = True
+        cumulative = present.reshape(P, m).cumsum(axis=1)
+        pointers = []
+        for target in targets:
+            k = target[s0 - start]
+            # the flat index of the k-th smallest rank of each trace and the number of ranks below
+            r = numpy.argmax(cumulative > k, axis=1) + rows[:, 0] * m
+            pointers.append((r, numpy.full(P, k, dtype=int), target))
+
+        for i in range(s0, s1):
+            if i > s0:
+                if i - 1 - h >= 0:
+                    removed = ranks[:, i - 1 - h - a]
+                    present[removed] = False
+                    for r, below, target in pointers:
+                        below -= removed < r
+                if i - h + window - 1 < T:
+                    inserted = ranks[:, i - h + window - 1 - a]
+                    present[inserted] = True
+                    for r, below, target in pointers:
+                        below += inserted < r
+                for r, below, target in pointers:
+                    _settle(present, r, below, target[i - start])
+            lo = values[pointers[0][0]]
+            if len(pointers) > 1 and fractions[i - start] > 0:
+                hi = values[pointers[1][0]]
+                result[:, i - start] = lo + fractions[i - start] * (hi - lo)
+            else:
+                result[:, i - start] = lo
+
+
+def _settle(present, r, below, k):
+    """
+    Move the pointers r to the present rank with k present ranks below, rank by rank. The pointers r and the number
+    of present ranks below them are updated in place.
+    """
+    active = numpy.arange(len(r))
+    while len(active) > 0:
+        ra, ba = r[active], below[active]
+        here = present[ra]
+        moving = ~here | (ba != k)
+        active, ra, ba, here = active[moving], ra[moving], ba[moving], here[moving]
+        down = ba > k
+        # moving up passes the current rank, moving down reaches the next one
+        ba += ~down & here
+        ra += numpy.where(down, -1, 1)
+        ba -= down & present[ra]
+        r[active] = ra
+        below[active] = ba
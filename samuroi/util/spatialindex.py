@@ -0,0 +1,105 @@
+import math
+
+
+class GridIndex(object):
+    """
+    A spatial index of bounding boxes on a uniform grid. Each item is registered in all grid cells its bounding box
+    overlaps, hence queries only need to look at the items within the cells of the query region, independent of the
+    total number of items. Items whose bounding box spans more than `maxcells` cells (e.g. a segmentation of the whole
+    image) are kept in a separate list, which is checked on every query.
+
+    .. code-block:: python
+
+        index = GridIndex(cellsize=32)
+        index.add(item, (x0, y0, x1, y1))
+        # all items whose bounding box intersects the given box
+        items = index.query((10, 10, 50, 50))
+    """
+
+    def __init__(self, cellsize=32, maxcells=256):
+        """
+        :param cellsize: the edge length of the grid cells.
+        :param maxcells: the maximal number of cells an item gets registered in.
+        """
+        self.cellsize = float(cellsize)
+        self.maxcells = maxcells
+        # map cell -> set of items
+        self.__cells = {}
+        # map item -> (bounding box, cells)
+        self.__items = {}
+        self.__large = set()
+
+    def __len__(self):
+        return len(self.__items)
+
+    def __contains__(self, item):
+        return item in self.__items
+
+    def __cells_of(self, bbox):
+        x0, y0, x1, y1 = bbox
+        return (range(int(math.floor(x0 / self.cellsize)), int(math.floor(x1 / self.cellsize)) + 1),
+                range(int(math.floor(y0 / self.cellsize)), int(math.floor(y1 / self.cellsize)) + 1))
+
+    def bounding_box(self, item):
+        """
+        :return: the bounding box the item was registered with.
+        """
+        return self.__items[item][0]
+
+    def add(self, item, bbox):
+        """
+        Register the item, or update its bounding box if it is already registered.
+
+        :param item: a hashable object.
+        :param bbox: tuple (x0, y0, x1, y1) with x0 <= x1 and y0 <= y1.
+        """
+        self.discard(item)
+        bbox = tuple(float(v) for v in bbox)
+        xs, ys = self.__cells_of(bbox)
+        if len(xs) * len(ys) > self.maxcells:
+            cells = None
+            self.__large.add(item)
+        else:
+            cells = [(x, y) for x in xs for y in ys]
+            for cell in cells:
+                self.__cells.setdefault(cell, set()).add(item)
+        self.__items[item] = (bbox, cells)
+
+    def discard(self, item):
+        """Remove the item from the index, if it is registered."""
+        if item not in self.__items:
+            return
+        bbox, cells = self.__items.pop(item)
+        if cells is None:
+            self.__large.discard(item)
+        else:
+            for cell in cells:
+                members = self.__cells[cell]
+                members.discard(item)
+                if len(members) == 0:
+                    del self.__cells[cell]
+
+    def query(self, bbox):
+        """
+        Find all items whose bounding box intersects the given box.
+
+        :param bbox: tuple (x0, y0, x1, y1).
+        :return: list of items.
+        """
+        x0, y0, x1, y1 = bbox
+        xs, ys = self.__cells_of(bbox)
+        candidates = set(self.__large)
+        if len(xs) * len(ys) > len(self.__cells):
+            # the query region is larger than the populated part of the grid
+            for members in self.__cells.itervalues():
+                candidates.update(members)
+        else:
+            for x in xs:
+                for y in ys:
+                    candidates.update(self.__cells.get((x, y), ()))
+        result = []
+        for item in candidates:
+            a0, b0, a1, b1 = self.__items[item][0]
+            if a0 <= x1 and x0 <= a1 and b0 <= y1 and y0 <= b1:
+                result.append(item)
+        return result
@@ -0,0 +1,117 @@
+from collections import OrderedDict
+
+import numpy
+import scipy.ndimage
+import skimage.filters
+import skimage.morphology
+
+from cached_property import cached_property
+
+
+class ThresholdOverlay(object):
+    """
+    Calculate the overlay of a morphology image for given threshold values, as done by
+    :py:attr:`samuroi.SamuROIData.threshold`: pixels below the threshold are marked as background, pixels above 1.1
+    times the threshold as foreground, and the pixels in between are assigned by a watershed on the sobel elevation map
+    of the morphology. The overlay is the foreground.
+
+    The elevation map only depends on the morphology and is calculated once. The watershed is restricted to the
+    connected regions of undecided pixels which touch both, background and foreground. Undecided regions which touch
+    only one kind of marker get its label directly. Since flooding can not pass labeled pixels, the result is the same as
+    for the watershed over the full image, up to the order in which pixels of equal elevation get flooded. But the
+    costs scale with the size of the contested regions only. Recently used overlays are memorized, hence sweeping the
+    threshold back and forth is a lookup.
+
+    .. code-block:: python
+
+        overlays = ThresholdOverlay(morphology)
+        overlay = overlays(threshold)
+        # the overlays for a range of thresholds, shape (len(thresholds),Y,X)
+        table = overlays.tabulate(numpy.linspace(0.5, 2., 16) * threshold)
+    """
+
+    # 4-connectivity, as used by the watershed
+    __structure = scipy.ndimage.generate_binary_structure(2, 1)
+
+    def __init__(self, morphology, cachesize=64):
+        """
+        :param morphology: the 2D morphology image.
+        :param cachesize: the number of overlays to memorize.
+        """
+        self.morphology = morphology
+        self.cachesize = cachesize
+        self.__cache = OrderedDict()
+
+    @cached_property
+    def elevation_map(self):
+        """The sobel filtered morphology, used as elevation map for the watershed."""
+        return skimage.filters.sobel(self.morphology)
+
+    def markers(self, threshold):
+        """
+        The markers of the watershed for the given threshold.
+
+        :return: integer array with 1 for background, 2 for foreground and 0 for undecided pixels.
+        """
+        markers = numpy.zeros(shape=self.morphology.shape, dtype=int)
+        markers[self.morphology < threshold] = 1
+        markers[self.morphology > threshold * 1.1] = 2
+        return markers
+
+    def __call__(self, threshold):
+        """
+        Get the overlay for the given threshold.
+
+        :param threshold: the threshold value.
+        :return: 2D boolean array, a new array for each call.
+        """
+        if threshold in self.__cache:
+            # mark the overlay as most recently used
+            overlay = self.__cache.pop(threshold)
+        else:
+            overlay = self.__calculate(threshold)
+            if len(self.__cache) >= self.cachesize:
+                self.__cache.popitem(last=False)
+        self.__cache[threshold] = overlay
+        return overlay.copy()
+
+    def tabulate(self, thresholds):
+        """
+        Stack the overlays for several thresholds. This is a convenience loop over the thresholds, each overlay costs
+        the same as a single call and gets memorized like it.
+
+        :param thresholds: iterable of threshold values.
+        :return: 3D boolean array with shape (len(thresholds),Y,X).
+        """
+        thresholds = list(thresholds)
+        table = numpy.empty(shape=(len(thresholds),) + self.morphology.shape, dtype=bool)
+        for i, threshold in enumerate(thresholds):
+            table[i] = self(threshold)
+        return table
+
+    def __calculate(self, threshold):
+        markers = self.markers(threshold)
+        overlay = markers == 2
+
+        # label the connected regions of undecided pixels, 0 for marker pixels
+        regions, nregions = scipy.ndimage.label(markers == 0, structure=self.__structure)
+        if nregions == 0:
+            return overlay
+
+        # find out which regions touch background and foreground markers
+        touches = numpy.zeros(shape=(3, nregions + 1), dtype=bool)
+        for label in (1, 2):
+            border = scipy.ndimage.binary_dilation(markers == label, structure=self.__structure)
+            touches[label, regions[border]] = True
+        touches[:, 0] = False
+
+        # regions which touch only foreground markers become foreground
+        overlay |= (touches[2] & ~touches[1])[regions]
+
+        # run the watershed for the contested regions and the markers around them only
+        contested = (touches[1] & touches[2])[regions]
+        if contested.any():
+            mask = scipy.ndimage.binary_dilation(contested, structure=self.__structure)
+            segmentation = skimage.morphology.watershed(self.elevation_map, markers, mask=mask)
+            overlay |= contested & (segmentation == 2)
+        return overlay
@@ -0,0 +1,36 @@
+import unittest
+
+import numpy
+
+from samuroi.samuroidata import SamuROIData
+from samuroi.masks.circle import CircleMask
+from samuroi.masks.pixel import PixelMask
+from samuroi.masks.polygon import PolygonMask
+
+
+class TestTraceCache(unittest.TestCase):
+    def setUp(self):
+        numpy.random.seed(0)
+        self.samudata = SamuROIData(numpy.random.rand(30, 40, 50))
+        self.samudata.threshold = 0.2
+        for mask in [PolygonMask(outline=numpy.array([[3.2, 4.1], [20.5, 6.3], [12., 25.7]])),
+                     CircleMask(center=(10, 12), radius=4.3),
+                     PixelMask(x=[1, 2, 3], y=[4, 5, 6])]:
+            self.samudata.masks.add(mask)
+
+    def test_overlay_changed(self):
+        """The traces updated incrementally for a new threshold equal the traces calculated from scratch."""
+        cache = self.samudata.tracecache
+        cache.traces()
+        sweep = numpy.linspace(0., 1., 40)
+        for threshold in numpy.concatenate([sweep[::-1], sweep]):
+            self.samudata.threshold = threshold
+            traces = cache.traces(postprocessed=False)
+            expected = self.samudata.traceextractor.traces()
+            numpy.testing.assert_array_equal(numpy.isnan(traces), numpy.isnan(expected))
+            numpy.testing.assert_allclose(traces[~numpy.isnan(traces)], expected[~numpy.isnan(expected)],
+                                          rtol=1e-10, atol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()